@@ -0,0 +1,23 @@
+"""
+ASGI config for ecommerce_backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_backend.settings')
+
+django.setup(set_prefix=False)
+
+from shop.asgi import ASGIHandler  # noqa: E402 (needs the apps to be loaded)
+from shop.search import get_search_backend  # noqa: E402
+
+application = ASGIHandler()
+
+get_search_backend().warm_up()
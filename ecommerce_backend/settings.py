@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import datetime
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +49,7 @@ AUTH_USER_MODEL = 'shop.User'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shop.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,8 +76,23 @@ TEMPLATES = [
     },
 ]
 
+# Responses of at least MIN_SIZE bytes are compressed with brotli, when it's installed, or
+# gzip. LEVELS, {content type: {'br': level, 'gzip': level}}, replaces the levels of
+# shop.middleware.DEFAULT_LEVELS; content types without levels, like images, are never
+# compressed.
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+}
+
 WSGI_APPLICATION = 'ecommerce_backend.wsgi.application'
 
+# Threads per process that run requests under ASGI, for the read-heavy catalog endpoints
+# and for everything else. Each thread keeps its own database connection.
+ASGI_THREADS = {
+    'read': 32,
+    'write': 8,
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -88,24 +105,96 @@ DATABASES = {
         'PASSWORD': 'password',
         'HOST': 'localhost',
         'PORT': '5432',
+        'OPTIONS': {
+            # Word similarity a product name needs to be suggested for a misspelled search
+            'options': '-c pg_trgm.word_similarity_threshold=0.4',
+        },
         'TEST': {
             'NAME': 'ecommerce_backend_test'
         }
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# Catalog entries are stored under the catalog version, so they can be kept in each
+# process, and LocMemCache evicts the least recently used one. The version itself must be
+# in a cache every process shares, or a change made in one process never reaches the
+# others: LocMemCache is only safe for it with a single process. The file-based default
+# is shared by the processes of one host; use Redis or memcached across hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000
+        }
+    },
+    'catalog_version': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'ecommerce_backend_catalog_version'),
+        'TIMEOUT': None,
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'ecommerce_backend_carts'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000
+        }
+    }
+}
+
+CATALOG_CACHE = 'catalog'
+CATALOG_VERSION_CACHE = 'catalog_version'
+
+# Anonymous carts are kept in CART_CACHE, which should be a shared key-value store such as
+# Redis in production, until they're moved to the database at checkout or login
+CART_STORE = 'shop.carts.CacheCartStore'
+CART_CACHE = 'carts'
+CART_COOKIE_NAME = 'cart'
+CART_TIMEOUT = 60 * 60 * 24 * 30
+
+# Keep every product name's words in memory to answer search suggestions without a query.
+# Rebuilt in the background when the catalog changes, about 500 bytes per product.
+SEARCH_SUGGEST_INDEX = False
+
+# Backend of product searches: 'shop.search.PostgresSearchBackend' uses the database's
+# full-text search, 'shop.search.InvertedIndexSearchBackend' a BM25 index kept in every
+# process, which only returns the best SEARCH_MAX_RESULTS matches of a search
+SEARCH_BACKEND = 'shop.search.PostgresSearchBackend'
+SEARCH_MAX_RESULTS = 1000
+
+# File the build_search_index command writes the inverted index to. Worker processes map
+# it instead of building their own copy, and catch up with changes made since.
+SEARCH_INDEX_PATH = None
+
+# Boundaries of the price ranges counted by search facets, the last range has no maximum
+SEARCH_PRICE_BUCKETS = (10, 25, 50, 100, 250, 500)
+
 # Rest Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES' : [
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        'shop.authentication.CachedJWTAuthentication'
         #'rest_framework.authentication.SessionAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES' : [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly'
     ],
     'COERCE_DECIMAL_TO_STRING': False,
+    # Same output as DRF's JSON renderer and parser, faster with orjson installed
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'shop.renderers.FastJSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'shop.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser'
     )
 }
 
@@ -113,10 +202,22 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': datetime.timedelta(minutes=30)
 }
 
+# Users authenticated by token are kept in a cache of each process for USER_CACHE_TTL
+# seconds, which is how long other processes may take to see a user deactivated
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
+# Password hashing runs on WORKERS threads per process. Logins and signups that can't get
+# one within QUEUE_TIMEOUT seconds are answered with 503 Service Unavailable.
+PASSWORD_HASHING = {
+    'WORKERS': 2,
+    'QUEUE_TIMEOUT': 1.0,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'shop.validators.PasswordValidator'
@@ -159,4 +260,16 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Puts a hash of the content in every uploaded file's name, so media URLs can be cached forever
+DEFAULT_FILE_STORAGE = 'shop.storage.HashedFileSystemStorage'
+
+# How the media view sends files: None streams them from Django, 'x-accel-redirect' hands
+# them to nginx through an internal location at MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT,
+# and 'x-sendfile' hands them to Apache or lighttpd
+MEDIA_SERVE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Number of processes that generate product image derivatives, 0 generates them inline
+IMAGE_WORKERS = 2
\ No newline at end of file
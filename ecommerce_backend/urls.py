@@ -13,10 +13,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework import routers
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -72,14 +73,28 @@ urlpatterns = [
     #path('v1/users/<int:user_pk>/cart/items/', item_list, name="item-list"),
     #path('v1/users/<int:user_pk>/cart/items/<int:pk>/', item_detail, name="item-detail"),
 
+    path('v1/cart/', views.CurrentCartView.as_view(), name="current-cart"),
+    path('v1/cart/items/', views.CurrentCartItemView.as_view(), name="current-cart-items"),
+    path('v1/cart/items/<int:product_id>/', views.CurrentCartItemView.as_view(), name="current-cart-item"),
+    path('v1/cart/checkout/', views.checkout, name="checkout"),
+
     path('v1/users/<int:user_pk>/orders/', auth_order_view, name="order-list"),
     path('v1/users/<int:user_pk>/orders/<int:pk>/', order_detail, name="order-detail"),
 
     path('v1/search/', views.SearchView.as_view(), name="search-list"),
-    path('v1/recommendations', views.recommendations),
+    path('v1/search/suggest/', views.search_suggest, name="search-suggest"),
+    path('v1/recommendations', views.recommendations, name="recommendations"),
 
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+media_urlpatterns = []
+if settings.MEDIA_URL.startswith('/'):
+    media_urlpatterns = [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), views.media, name='media'),
+    ]
+
+# Without MEDIA_SERVE the files would be streamed by app workers, which is only for development
+if settings.DEBUG or getattr(settings, 'MEDIA_SERVE', None):
+    urlpatterns += media_urlpatterns
\ No newline at end of file
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_backend.settings')
 
 application = get_wsgi_application()
+
+from shop.search import get_search_backend  # noqa: E402 (needs the apps to be loaded)
+
+get_search_backend().warm_up()
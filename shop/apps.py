@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class ShopConfig(AppConfig):
     name = 'shop'
+
+    def ready(self):
+        from django.db.models import CharField, TextField
+
+        from . import signals
+        from .lookups import TrigramWordSimilar
+
+        CharField.register_lookup(TrigramWordSimilar)
+        TextField.register_lookup(TrigramWordSimilar)
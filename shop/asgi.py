@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler
+from django.db import close_old_connections
+from django.urls import Resolver404, get_resolver
+
+# URL names of the read-heavy endpoints that get their own thread pool
+READ_VIEWS = {
+    'product-list',
+    'product-detail',
+    'product-featured',
+    'product-new',
+    'search-list',
+    'search-suggest',
+    'recommendations',
+}
+
+READ_METHODS = ('GET', 'HEAD')
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """
+    Returns the thread pool named `name`, sized by the ASGI_THREADS setting.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            max_workers = getattr(settings, 'ASGI_THREADS', {}).get(name, 16)
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'asgi-{name}')
+        return _executors[name]
+
+
+def is_read(request):
+    if request.method not in READ_METHODS:
+        return False
+    try:
+        match = get_resolver().resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.url_name in READ_VIEWS
+
+
+class ASGIHandler(DjangoASGIHandler):
+    """
+    ASGI handler that never blocks the event loop on a request. Django 3.0 can't run
+    coroutine views, so each request still goes through the middleware and view in a
+    thread. Reads and writes run on separate pools, so slow searches can't starve
+    checkouts.
+
+    Worker threads keep their database connection between requests and close it like
+    the WSGI handler does at the end of each one, following CONN_MAX_AGE.
+    """
+    async def get_response(self, request):
+        executor = get_executor('read' if is_read(request) else 'write')
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, self.get_response_in_thread, request)
+
+    def get_response_in_thread(self, request):
+        close_old_connections()
+        try:
+            return super().get_response(request)
+        finally:
+            close_old_connections()
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        # Streamed content, like order exports, may query the database and is compressed
+        # as it's consumed, which can't be done on the event loop. One thread consumes all of it, since a
+        # database cursor can't move between threads.
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+
+        loop = asyncio.get_event_loop()
+        parts = iter(response)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='asgi-stream') as executor:
+            try:
+                while True:
+                    part = await loop.run_in_executor(executor, next, parts, None)
+                    if part is None:
+                        break
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body'})
+            finally:
+                await loop.run_in_executor(executor, response.close)
+
+
+def response_headers(response):
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(value, str):
+            value = value.encode('latin1')
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+    return headers
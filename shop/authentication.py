@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+
+class UserCache:
+    """
+    Least recently used users by primary key, each kept for `ttl` seconds.
+
+    Only field values are kept, and every `get` builds a new User from them, so requests
+    never share an instance.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.field_names = [field.attname for field in User._meta.concrete_fields]
+
+    def get(self, pk):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(pk)
+            if entry is None:
+                return None
+            expires, values = entry
+            if expires <= now:
+                del self.entries[pk]
+                return None
+            self.entries.move_to_end(pk)
+        return User.from_db(DEFAULT_DB_ALIAS, self.field_names, values)
+
+    def set(self, user):
+        values = [getattr(user, name) for name in self.field_names]
+        with self.lock:
+            self.entries[user.pk] = (time.monotonic() + self.ttl, values)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, pk):
+        with self.lock:
+            self.entries.pop(pk, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(getattr(settings, 'USER_CACHE_SIZE', 10000), getattr(settings, 'USER_CACHE_TTL', 30))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves users through the process' user cache, so only the
+    first request of a user in USER_CACHE_TTL seconds queries the database.
+
+    Saving or deleting a user drops them from the cache of the process that did it,
+    and other processes see the change once the entry expires. Only active users are
+    cached, so deleted and deactivated ones are rejected like by JWTAuthentication.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user)
+        return user
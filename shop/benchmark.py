@@ -0,0 +1,355 @@
+import asyncio
+import io
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.db import connection, connections
+from django.test import Client, RequestFactory
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import cache, passwords
+from .asgi import ASGIHandler
+from .models import Order, Product, User
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .seed import PASSWORD, WORDS
+from .serializers import OrderSerializer, ProductReadSerializer
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts queries and the time spent running them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def products(client, rng, data):
+    return client.get('/v1/products/')
+
+
+def featured(client, rng, data):
+    return client.get('/v1/products/featured/')
+
+
+def search(client, rng, data):
+    return client.get('/v1/search/', {'q': rng.choice(WORDS)})
+
+
+def recommendations(client, rng, data):
+    return client.get('/v1/recommendations', {'id': rng.choice(data['product_ids'])})
+
+
+def order_create(client, rng, data):
+    items = rng.sample(data['product_ids'], min(3, len(data['product_ids'])))
+    return client.post('/v1/orders/', json.dumps({
+        'first_name': 'Bench', 'last_name': 'Order', 'address1': '1 Main St', 'address2': 'Apt 1',
+        'city': 'Springfield', 'region': 'IL', 'zip': '62701', 'country': 'US',
+        'items': [{'product_id': pk, 'quantity': 1} for pk in items]
+    }), content_type='application/json')
+
+
+def token(client, rng, data):
+    return client.post('/v1/token/', json.dumps({
+        'email': rng.choice(data['emails']), 'password': PASSWORD
+    }), content_type='application/json')
+
+
+ENDPOINTS = {
+    'products': products,
+    'featured': featured,
+    'search': search,
+    'recommendations': recommendations,
+    'order_create': order_create,
+    'token': token,
+}
+
+
+def run_benchmark(endpoints=None, requests=100, warmup=5, cold=False, seed=0):
+    """
+    Sends `requests` requests to every endpoint through the Django test client and
+    returns latency percentiles (ms), throughput, status errors and SQL counts per endpoint.
+
+    `cold` clears the catalog cache before every request.
+    """
+    rng = random.Random(seed)
+    client = Client()
+    data = {
+        'product_ids': list(Product.objects.values_list('pk', flat=True)[:10000]),
+        'emails': list(User.objects.values_list('email', flat=True)[:1000]),
+    }
+
+    results = {}
+    for name in endpoints or ENDPOINTS:
+        make_request = ENDPOINTS[name]
+        if name in ('recommendations', 'order_create') and not data['product_ids']:
+            continue
+        if name == 'token' and not data['emails']:
+            continue
+
+        for _ in range(warmup):
+            make_request(client, rng, data)
+
+        latencies = []
+        errors = 0
+        timer = QueryTimer()
+        passwords.reset_stats()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            for _ in range(requests):
+                if cold:
+                    cache.get_cache().clear()
+                start = time.perf_counter()
+                response = make_request(client, rng, data)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    errors += 1
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        results[name] = {
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'throughput_rps': requests / elapsed,
+            'queries_per_request': timer.count / requests,
+            'query_ms_per_request': timer.time * 1000 / requests,
+        }
+        hashing = passwords.get_stats()
+        if hashing['hashes']:
+            results[name].update({
+                'hash_ms_mean': hashing['hash_ms'] / hashing['hashes'],
+                'hash_wait_ms_mean': hashing['wait_ms'] / hashing['hashes'],
+                'hash_max_waiting': hashing['max_waiting'],
+                'hash_rejected': hashing['rejected'],
+            })
+
+    return results
+
+
+def compare(results, baseline, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')):
+    """
+    Returns (endpoint, metric, baseline, current, change) rows for endpoints in both runs,
+    where change is the relative difference to the baseline.
+    """
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in metrics:
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            if before:
+                change = (after - before) / before
+            else:
+                change = float('inf') if after else 0.0
+            rows.append((name, metric, before, after, change))
+    return rows
+
+
+READ_ENDPOINTS = ('products', 'featured', 'search', 'recommendations')
+
+
+def read_request(name, rng, data):
+    """
+    Returns the (path, query string) of a request to a read endpoint.
+    """
+    if name == 'search':
+        return '/v1/search/', urlencode({'q': rng.choice(WORDS)})
+    if name == 'recommendations':
+        return '/v1/recommendations', urlencode({'id': rng.choice(data['product_ids'])})
+    return {'products': '/v1/products/', 'featured': '/v1/products/featured/'}[name], ''
+
+
+def latency_summary(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'throughput_rps': len(latencies) / elapsed,
+    }
+
+
+def run_wsgi_clients(name, data, concurrency, requests, workers, seed=0):
+    """
+    Sends requests from `concurrency` clients at once to the WSGI handler behind
+    `workers` sync workers, each serving one request at a time like a prefork server.
+    """
+    slots = threading.Semaphore(workers)
+    latencies = []
+    errors = []
+
+    def client(index):
+        rng = random.Random(seed + index)
+        django_client = Client()
+        try:
+            for _ in range(requests // concurrency):
+                path, query = read_request(name, rng, data)
+                start = time.perf_counter()
+                with slots:
+                    response = django_client.get(path, QUERY_STRING=query)
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors.append(response.status_code >= 400)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    return latency_summary(latencies, sum(errors), time.perf_counter() - started)
+
+
+async def asgi_get(application, path, query=''):
+    """
+    Sends a GET request to an ASGI application and returns the response status.
+    """
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': query.encode('ascii'),
+        'headers': [(b'host', b'testserver')],
+        'scheme': 'http',
+        'server': ('testserver', 80),
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+def run_asgi_clients(name, data, concurrency, requests, seed=0):
+    """
+    Sends requests from `concurrency` clients at once to one process running the ASGI
+    handler, which serves them on its thread pools.
+    """
+    application = ASGIHandler()
+    latencies = []
+    errors = []
+
+    async def client(index):
+        rng = random.Random(seed + index)
+        for _ in range(requests // concurrency):
+            path, query = read_request(name, rng, data)
+            start = time.perf_counter()
+            status = await asgi_get(application, path, query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors.append(status >= 400)
+
+    async def clients():
+        await asyncio.gather(*(client(index) for index in range(concurrency)))
+
+    # The event loop gets its own thread so closing responses doesn't touch this
+    # thread's database connection
+    started = time.perf_counter()
+    thread = threading.Thread(target=asyncio.run, args=(clients(),))
+    thread.start()
+    thread.join()
+    return latency_summary(latencies, sum(errors), time.perf_counter() - started)
+
+
+def run_concurrency_benchmark(endpoints=None, concurrency=50, requests=200, workers=4, seed=0):
+    """
+    Compares latency and throughput of read endpoints under `concurrency` simultaneous
+    clients between `workers` WSGI sync workers and a single ASGI process.
+    """
+    data = {'product_ids': list(Product.objects.values_list('pk', flat=True)[:10000])}
+
+    results = {}
+    for name in endpoints or READ_ENDPOINTS:
+        if name not in READ_ENDPOINTS or (name == 'recommendations' and not data['product_ids']):
+            continue
+        results[name] = {
+            'wsgi': run_wsgi_clients(name, data, concurrency, requests, workers, seed),
+            'asgi': run_asgi_clients(name, data, concurrency, requests, seed),
+        }
+    return results
+
+
+def renderer_payloads(count=100):
+    """
+    Returns the serialized data of a product list and an order list of `count` rows each.
+    """
+    from .views import ORDER_ITEMS
+
+    request = Request(RequestFactory().get('/v1/products/'))
+    products = Product.objects.order_by('pk').values(*ProductReadSerializer.values_fields)[:count]
+    orders = Order.objects.order_by('pk').prefetch_related(ORDER_ITEMS)[:count]
+    return {
+        'products': ProductReadSerializer(products, many=True, context={'request': request}).data,
+        'orders': OrderSerializer(orders, many=True, context={'request': request}).data,
+    }
+
+
+def time_calls(function, argument, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(argument)
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+
+def run_renderer_benchmark(count=100, repeat=50):
+    """
+    Renders and parses product and order lists `repeat` times with DRF's JSON renderer
+    and parser and with the fast ones, and returns the mean ms of each per payload and
+    whether both rendered the same bytes.
+    """
+    results = {}
+    for name, data in renderer_payloads(count).items():
+        drf_ms, drf_output = time_calls(JSONRenderer().render, data, repeat)
+        fast_ms, fast_output = time_calls(FastJSONRenderer().render, data, repeat)
+        drf_parse_ms, _ = time_calls(lambda body: JSONParser().parse(io.BytesIO(body)), drf_output, repeat)
+        fast_parse_ms, _ = time_calls(lambda body: FastJSONParser().parse(io.BytesIO(body)), drf_output, repeat)
+
+        results[name] = {
+            'rows': len(data),
+            'bytes': len(drf_output),
+            'identical': drf_output == fast_output,
+            'render_drf_ms': drf_ms,
+            'render_fast_ms': fast_ms,
+            'parse_drf_ms': drf_parse_ms,
+            'parse_fast_ms': fast_parse_ms,
+        }
+    return results
@@ -0,0 +1,145 @@
+import functools
+import hashlib
+import threading
+import time
+from calendar import timegm
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.response import Response
+
+VERSION_KEY = 'catalog:version'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the cache configured for the catalog with the CATALOG_CACHE setting.
+    """
+    return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+
+def get_version_cache():
+    """
+    Returns the cache the catalog version is kept in, CATALOG_VERSION_CACHE, which every
+    process must share for a change to reach all of them.
+    """
+    return caches[getattr(settings, 'CATALOG_VERSION_CACHE', getattr(settings, 'CATALOG_CACHE', 'default'))]
+
+
+def get_catalog_version():
+    cache = get_version_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so a version that was evicted is never handed out again
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Moves the catalog to a new version, which makes every cached catalog response stale.
+    """
+    # A new value from the clock rather than incr, which most backends, like the file
+    # cache, implement as a get and a set: two bumps could both set the same version
+    # and leave responses cached between them current
+    cache = get_version_cache()
+    version = time.time_ns()
+    # Clocks coarser than a nanosecond can repeat the current version
+    if version == cache.get(VERSION_KEY):
+        version += 1
+    cache.set(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def get_or_compute(key, compute):
+    """
+    Returns the value cached under `key` for the current catalog version, computing and
+    caching it on a miss.
+    """
+    cache = get_cache()
+    version = get_catalog_version()
+    value = cache.get(key, version=version)
+    if value is None:
+        value = compute()
+        cache.set(key, value, version=version)
+    return value
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats['hits'] = 0
+        _stats['misses'] = 0
+
+
+def _record(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def cache_catalog_response(view_method):
+    """
+    Caches the serialized data of a successful catalog response by URL under the
+    current catalog version.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        cache = get_cache()
+        version = get_catalog_version()
+        key = 'catalog:' + hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+
+        data = cache.get(key, version=version)
+        if data is not None:
+            _record('hits')
+            return Response(data)
+
+        _record('misses')
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, version=version)
+        return response
+
+    return wrapper
+
+
+def conditional_response(validators):
+    """
+    Answers conditional GETs with 304 Not Modified, like Django's `condition` decorator,
+    but takes the ETag and last modification time from a single call of
+    `validators(view, request, *args, **kwargs)` so both can come from one query.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            etag, last_modified = validators(self, request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+            else:
+                # The type the 200 would have had, which the compression middleware needs
+                response.representation_type = request.accepted_media_type
+
+            if request.method in ('GET', 'HEAD') and (200 <= response.status_code < 300 or response.status_code == 304):
+                if etag and not response.has_header('ETag'):
+                    response['ETag'] = etag
+                if last_modified and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,181 @@
+import re
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Cart, CartItem, Product
+
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class CartStore:
+    """
+    Keeps the lines of carts, as {product_id: quantity}, under a key such as a user's
+    primary key or an anonymous cart's cookie.
+    """
+    def get(self, key):
+        raise NotImplementedError
+
+    def add(self, key, product, quantity=1):
+        raise NotImplementedError
+
+    def set(self, key, product, quantity):
+        raise NotImplementedError
+
+    def remove(self, key, product_id):
+        raise NotImplementedError
+
+    def clear(self, key):
+        raise NotImplementedError
+
+
+class DatabaseCartStore(CartStore):
+    """
+    Stores a user's cart in Cart and CartItem rows, keyed by the user's primary key. The
+    Cart row is only created when the first product is added.
+    """
+    def get(self, key):
+        return dict(CartItem.objects.filter(cart__user_id=key).order_by('pk').values_list('product_id', 'quantity'))
+
+    def add(self, key, product, quantity=1):
+        cart, _ = Cart.objects.get_or_create(user_id=key)
+        cart.add_item(product, quantity)
+
+    def set(self, key, product, quantity):
+        item = CartItem.objects.select_related('cart').filter(cart__user_id=key, product=product).first()
+        if item is None:
+            self.add(key, product, quantity)
+        else:
+            item.product = product
+            item.cart.set_item_quantity(item, quantity)
+
+    def remove(self, key, product_id):
+        item = CartItem.objects.select_related('cart', 'product').filter(cart__user_id=key,
+                                                                          product_id=product_id).first()
+        if item is not None:
+            item.cart.remove_item(item)
+
+    def clear(self, key):
+        with transaction.atomic():
+            CartItem.objects.filter(cart__user_id=key).delete()
+            Cart.objects.filter(user_id=key).update(subtotal=0, item_count=0)
+
+
+class CacheCartStore(CartStore):
+    """
+    Stores carts as single entries of a key-value cache, the CART_CACHE setting, so
+    changing a cart costs one write and abandoned carts simply expire.
+
+    Changes are read-modify-write, which is fine for a cart used by one client at a time.
+    """
+    prefix = 'cart:'
+
+    def __init__(self, alias=None, timeout=None):
+        self.cache = caches[alias or getattr(settings, 'CART_CACHE', 'default')]
+        self.timeout = timeout or getattr(settings, 'CART_TIMEOUT', 60 * 60 * 24 * 30)
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key) or {}
+
+    def add(self, key, product, quantity=1):
+        lines = self.get(key)
+        lines[product.pk] = lines.get(product.pk, 0) + quantity
+        self.cache.set(self.prefix + key, lines, self.timeout)
+
+    def set(self, key, product, quantity):
+        lines = self.get(key)
+        lines[product.pk] = quantity
+        self.cache.set(self.prefix + key, lines, self.timeout)
+
+    def remove(self, key, product_id):
+        lines = self.get(key)
+        if lines.pop(product_id, None) is not None:
+            self.cache.set(self.prefix + key, lines, self.timeout)
+
+    def clear(self, key):
+        self.cache.delete(self.prefix + key)
+
+
+def get_user_store():
+    return DatabaseCartStore()
+
+
+def get_anonymous_store():
+    """
+    Returns the store for carts of anonymous clients, the CART_STORE setting.
+    """
+    return import_string(getattr(settings, 'CART_STORE', 'shop.carts.CacheCartStore'))()
+
+
+def get_cart(request):
+    """
+    Returns (store, key) of the request's cart: the user's cart for authenticated
+    requests, otherwise the anonymous cart named by the cart cookie. The key is None
+    if an anonymous client doesn't have a cart yet.
+    """
+    if request.user and request.user.is_authenticated:
+        return get_user_store(), request.user.pk
+
+    key = request.COOKIES.get(settings.CART_COOKIE_NAME)
+    if key is not None and not is_cart_key(key):
+        key = None
+    return get_anonymous_store(), key
+
+
+def is_cart_key(key):
+    """
+    Whether `key`, which comes from a client, can name an anonymous cart.
+    """
+    return KEY_PATTERN.match(key) is not None
+
+
+def new_cart_key():
+    return secrets.token_urlsafe(24)
+
+
+def cart_data(lines, serializer_context):
+    """
+    Renders cart lines with their products and the total at current prices.
+    """
+    from .serializers import ProductSerializer
+
+    products = Product.objects.select_related('images').in_bulk(list(lines))
+    items = []
+    total = 0
+    item_count = 0
+    for product_id, quantity in lines.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        items.append({
+            'product': ProductSerializer(product, context=serializer_context).data,
+            'quantity': quantity,
+        })
+        total += product.price * quantity
+        item_count += quantity
+
+    return {'items': items, 'total': float(total), 'item_count': item_count}
+
+
+def persist_cart(key, user):
+    """
+    Moves an anonymous cart into the user's database cart, e.g. when they log in.
+    """
+    if not is_cart_key(key):
+        return
+
+    store = get_anonymous_store()
+    lines = store.get(key)
+    if not lines:
+        return
+
+    products = Product.objects.only('pk', 'price').in_bulk(list(lines))
+    user_store = get_user_store()
+    with transaction.atomic():
+        for product_id, quantity in lines.items():
+            if product_id in products:
+                user_store.add(user.pk, products[product_id], quantity)
+    store.clear(key)
@@ -31,4 +31,14 @@ class ItemAlreadyExists(APIException):
 
 class NoItemsException(APIException):
     status_code = 400
-    default_detail = "No items provided"
\ No newline at end of file
+    default_detail = "No items provided"
+
+
+class InvalidQueryParameter(APIException):
+    status_code = 400
+    default_detail = "Invalid query parameter"
+
+
+class HashingPoolBusy(APIException):
+    status_code = 503
+    default_detail = "Too many logins at once, try again shortly."
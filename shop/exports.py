@@ -0,0 +1,117 @@
+import csv
+import datetime
+import json
+
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Order, OrderItem
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ORDER_FIELDS = ('pk', 'order_date', 'user_id', 'first_name', 'last_name', 'address1', 'address2', 'city',
+                'region', 'zip', 'country', 'total')
+
+CSV_HEADER = ('order_id', 'order_date', 'user_id', 'first_name', 'last_name', 'address1', 'address2', 'city',
+              'region', 'zip', 'country', 'total', 'product_id', 'product_name', 'price', 'quantity')
+
+EXPORT_ITEMS = Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+
+
+def parse_bound(value, end=False):
+    """
+    Parses a date or an ISO 8601 datetime into an aware datetime. A date used as an end
+    bound covers the whole day. Raises ValueError for anything else.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'\'{value}\' is not a date or datetime')
+        if end:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time())
+
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(start=None, end=None):
+    """
+    Orders placed in [start, end), oldest first.
+    """
+    queryset = Order.objects.order_by('order_date', 'pk')
+    if start is not None:
+        queryset = queryset.filter(order_date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(order_date__lt=end)
+    return queryset
+
+
+def iter_orders(queryset, chunk_size=1000):
+    """
+    Yields the orders of a queryset with their items and products loaded, holding only
+    one chunk of them in memory at a time.
+    """
+    chunk = []
+    for order in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) >= chunk_size:
+            prefetch_related_objects(chunk, EXPORT_ITEMS)
+            yield from chunk
+            chunk = []
+
+    prefetch_related_objects(chunk, EXPORT_ITEMS)
+    yield from chunk
+
+
+class Echo:
+    """
+    File-like object that returns what's written to it, for csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(orders):
+    """
+    Yields a header and one CSV line per order item.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in orders:
+        values = [getattr(order, field) for field in ORDER_FIELDS]
+        values[1] = values[1].isoformat()
+        for item in order.items.all():
+            yield writer.writerow(values + [item.product_id, item.product.name, item.product.price, item.quantity])
+
+
+def ndjson_lines(orders):
+    """
+    Yields one JSON object per order, with its items, per line.
+    """
+    for order in orders:
+        data = {field: getattr(order, field) for field in ORDER_FIELDS}
+        data['order_date'] = order.order_date.isoformat()
+        data['total'] = str(order.total)
+        data['items'] = [{
+            'pk': item.pk,
+            'product_id': item.product_id,
+            'product_name': item.product.name,
+            'price': str(item.product.price),
+            'quantity': item.quantity,
+        } for item in order.items.all()]
+        yield json.dumps(data, separators=(',', ':')) + '\n'
+
+
+def export_orders(export_format='csv', start=None, end=None, chunk_size=1000):
+    """
+    Yields the lines of an export of the orders placed in [start, end).
+    """
+    lines = csv_lines if export_format == 'csv' else ndjson_lines
+    return lines(iter_orders(export_queryset(start, end), chunk_size))
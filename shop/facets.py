@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import Product
+
+FLAGS = ('on_sale', 'new', 'featured')
+
+DEFAULT_PRICE_BUCKETS = (10, 25, 50, 100, 250, 500)
+
+
+def wants_facets(request):
+    return request.query_params.get('facets', '').lower() in ('1', 'true')
+
+
+def price_buckets():
+    """
+    Returns the (min, max) price ranges of the histogram, from the SEARCH_PRICE_BUCKETS
+    boundaries. The last range has no maximum.
+    """
+    boundaries = [Decimal(str(b)) for b in getattr(settings, 'SEARCH_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)]
+    return list(zip([Decimal(0)] + boundaries, boundaries + [None]))
+
+
+def facet_counts(queryset, filters):
+    """
+    Counts the products of `queryset` per category, per flag and per price range with
+    one aggregate query.
+
+    `filters` maps the facet names 'category', 'price' and the flags to the conditions
+    the search applies for them. Each facet's counts apply every filter but its own, so
+    picking a category still shows how many results the other categories have.
+    """
+    def others(name):
+        condition = Q()
+        for facet, facet_condition in filters.items():
+            if facet != name:
+                condition &= facet_condition
+        return condition
+
+    aggregates = {}
+    for value, _ in Product.CATEGORIES:
+        aggregates[f'category_{value}'] = Count('pk', filter=Q(category=value) & others('category'))
+    for flag in FLAGS:
+        aggregates[f'flag_{flag}'] = Count('pk', filter=Q(**{flag: True}) & others(flag))
+
+    buckets = price_buckets()
+    for i, (low, high) in enumerate(buckets):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{i}'] = Count('pk', filter=condition & others('price'))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+
+    return {
+        'category': [{'value': value, 'name': name, 'count': counts[f'category_{value}']}
+                     for value, name in Product.CATEGORIES],
+        **{flag: counts[f'flag_{flag}'] for flag in FLAGS},
+        'price': [{'min': low, 'max': high, 'count': counts[f'price_{i}']}
+                  for i, (low, high) in enumerate(buckets)],
+    }
@@ -0,0 +1,73 @@
+from .exceptions import InvalidQueryParameter
+from .serializers import ImageSetSerializer, ProductSerializer
+
+FIELDS = tuple(ProductSerializer.Meta.fields)
+IMAGE_FIELDS = tuple(ImageSetSerializer.Meta.fields)
+
+EXPANSIONS = ('images',)
+
+
+def split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def product_fieldset(request):
+    """
+    Returns the (fields, image fields) of the product representation the request asks
+    for, in the order they're sent.
+
+    `fields` is a comma separated list of ProductSerializer's fields, where `images.<size>`
+    asks for a single image, e.g. `fields=name,price,slug,images.img100x100`. Images are
+    only sent when `fields` names them or with `expand=images`. Without `fields` every
+    field is sent.
+    """
+    expand = split(request.query_params.get('expand', ''))
+    for name in expand:
+        if name not in EXPANSIONS:
+            raise InvalidQueryParameter(f"'expand' must be one of {', '.join(EXPANSIONS)}")
+
+    requested = split(request.query_params.get('fields', ''))
+    if not requested:
+        return FIELDS, IMAGE_FIELDS
+
+    fields = set(expand)
+    image_fields = set()
+    for name in requested:
+        field, _, image = name.partition('.')
+        if field == 'images' and image in IMAGE_FIELDS:
+            image_fields.add(image)
+        elif field not in FIELDS or image:
+            raise InvalidQueryParameter(f"'{name}' is not a product field")
+        fields.add(field)
+
+    return (tuple(field for field in FIELDS if field in fields),
+            tuple(field for field in IMAGE_FIELDS if field in (image_fields or IMAGE_FIELDS)))
+
+
+def product_values(fieldset, *extra):
+    """
+    Returns the names to load products with, by values() or only(), to represent them
+    with `fieldset`, followed by the `extra` ones the view needs, such as the ordering.
+    """
+    fields, image_fields = fieldset
+    names = []
+    for field in fields:
+        if field == 'url':
+            names.append('slug')
+        elif field == 'images':
+            names.extend('images__' + image for image in image_fields)
+        else:
+            names.append(field)
+    return tuple(dict.fromkeys(names + [name.lstrip('-') for name in extra]))
+
+
+def only_fieldset(queryset, fieldset):
+    """
+    Narrows a queryset of products to the columns `fieldset` needs, joining the images
+    only when they're asked for.
+    """
+    if 'images' in fieldset[0]:
+        queryset = queryset.select_related('images')
+    else:
+        queryset = queryset.select_related(None)
+    return queryset.only(*product_values(fieldset))
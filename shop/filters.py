@@ -0,0 +1,81 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .exceptions import InvalidQueryParameter
+from .models import Product
+
+# Orderings of the `sort` query parameter, ending with a unique field for keyset pagination,
+# with every column sorted the same way so the (price, id) index serves either price order
+SORTS = {
+    'price': ('price', 'pk'),
+    '-price': ('-price', '-pk'),
+    'newest': ('-pk',),
+}
+
+BOOLEANS = {'1': True, 'true': True, '0': False, 'false': False}
+
+
+def parse_price(request, name):
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise InvalidQueryParameter(f"'{name}' is not a number")
+    if not price.is_finite() or price < 0:
+        raise InvalidQueryParameter(f"'{name}' is not a valid price")
+    # Prices that don't fit the column would overflow it in the query
+    try:
+        Product._meta.get_field('price').run_validators(price)
+    except ValidationError:
+        raise InvalidQueryParameter(f"'{name}' is not a valid price")
+    return price
+
+
+def product_filters(request):
+    """
+    Returns {facet: condition} for the catalog filters in the request's query string:
+    `category`, `min_price`/`max_price` and `on_sale`. An unknown category is ignored,
+    like the search always did.
+    """
+    filters = {}
+
+    try:
+        category = int(request.query_params.get('category', ''))
+    except ValueError:
+        category = None
+    if category in dict(Product.CATEGORIES):
+        filters['category'] = Q(category=category)
+
+    price = Q()
+    min_price = parse_price(request, 'min_price')
+    if min_price is not None:
+        price &= Q(price__gte=min_price)
+    max_price = parse_price(request, 'max_price')
+    if max_price is not None:
+        price &= Q(price__lte=max_price)
+    if price:
+        filters['price'] = price
+
+    on_sale = request.query_params.get('on_sale')
+    if on_sale is not None and on_sale != '':
+        if on_sale.lower() not in BOOLEANS:
+            raise InvalidQueryParameter("'on_sale' must be true or false")
+        filters['on_sale'] = Q(on_sale=BOOLEANS[on_sale.lower()])
+
+    return filters
+
+
+def product_sort(request):
+    """
+    Returns the ordering for the request's `sort` parameter, or None without one.
+    """
+    sort = request.query_params.get('sort')
+    if sort is None or sort == '':
+        return None
+    if sort not in SORTS:
+        raise InvalidQueryParameter(f"'sort' must be one of {', '.join(SORTS)}")
+    return SORTS[sort]
@@ -0,0 +1,138 @@
+import functools
+import io
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Field name -> size of every derivative generated from an ImageSet's source image
+DERIVATIVES = {
+    'img100x100': (100, 100),
+    'img690x400': (690, 400),
+    'img1920x1080': (1920, 1080),
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def render_derivatives(source_name):
+    """
+    Renders a JPEG and, where Pillow supports it, a WebP of every derivative size from
+    the source image, cropped to the target aspect ratio and without metadata.
+
+    Runs in a worker process, so it only touches storage, never the database.
+    """
+    from PIL import Image, ImageOps, features
+
+    with default_storage.open(source_name, 'rb') as f:
+        source = Image.open(f)
+        source.load()
+
+    # Apply the EXIF orientation before the metadata is dropped
+    source = ImageOps.exif_transpose(source).convert('RGB')
+    webp = features.check('webp')
+
+    derivatives = {}
+    for field, size in DERIVATIVES.items():
+        image = ImageOps.fit(source, size, Image.LANCZOS)
+
+        formats = [(field, 'JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True})]
+        if webp:
+            formats.append((field + '_webp', 'WEBP', {'quality': WEBP_QUALITY, 'method': 4}))
+
+        for name, image_format, options in formats:
+            content = io.BytesIO()
+            image.save(content, image_format, **options)
+            derivatives[name] = {
+                'content': content.getvalue(),
+                'format': image_format.lower(),
+                'width': image.width,
+                'height': image.height,
+            }
+
+    return derivatives
+
+
+def store_derivatives(image_set_pk, source_name, derivatives):
+    """
+    Saves rendered derivatives to storage and records them on the image set, unless its
+    source was replaced in the meantime.
+    """
+    from .models import ImageSet, Product
+
+    image_set = ImageSet.objects.filter(pk=image_set_pk, source=source_name).first()
+    if image_set is None:
+        return
+
+    changes = {}
+    metadata = {'source': source_name}
+    for field, derivative in derivatives.items():
+        extension = 'jpg' if derivative['format'] == 'jpeg' else derivative['format']
+        width, height = derivative['width'], derivative['height']
+        name = default_storage.save(f'images/{image_set.product_id}-{width}x{height}.{extension}',
+                                    ContentFile(derivative['content']))
+        changes[field] = name
+        metadata[field] = {
+            'width': width,
+            'height': height,
+            'bytes': len(derivative['content']),
+        }
+
+    changes['derivatives'] = metadata
+    ImageSet.objects.filter(pk=image_set_pk, source=source_name).update(**changes)
+    # Queryset updates don't send signals, so touch the product like an ImageSet save would
+    Product.objects.filter(pk=image_set.product_id).update(updated_at=timezone.now())
+
+
+def process_image_set(image_set):
+    """
+    Generates the derivatives of an image set's source image in the current process.
+    """
+    store_derivatives(image_set.pk, image_set.source.name, render_derivatives(image_set.source.name))
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+                                        initializer=django.setup)
+        return _pool
+
+
+def _derivatives_done(image_set_pk, source_name, submitted_by, future):
+    try:
+        store_derivatives(image_set_pk, source_name, future.result())
+    except Exception:
+        logger.exception('Could not generate derivatives of image set %s', image_set_pk)
+    finally:
+        # The pool's result thread opened its own connection; the submitting thread keeps its own
+        if threading.get_ident() != submitted_by:
+            connections.close_all()
+
+
+def process_image_set_async(image_set):
+    """
+    Queues derivative generation for an image set on the process pool. With IMAGE_WORKERS
+    set to 0 the work is done in the calling thread instead.
+    """
+    if getattr(settings, 'IMAGE_WORKERS', 2) == 0:
+        process_image_set(image_set)
+        return None
+
+    source_name = image_set.source.name
+    future = get_pool().submit(render_derivatives, source_name)
+    future.add_done_callback(functools.partial(_derivatives_done, image_set.pk, source_name, threading.get_ident()))
+    return future
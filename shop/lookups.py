@@ -0,0 +1,24 @@
+from django.contrib.postgres.lookups import PostgresSimpleLookup
+from django.db.models import FloatField, Func, Value
+
+
+class TrigramWordSimilar(PostgresSimpleLookup):
+    """
+    `name__trigram_word_similar='iphnoe'` matches names with a word similar to the
+    string, using pg_trgm's word similarity threshold. Uses trigram indexes.
+    """
+    lookup_name = 'trigram_word_similar'
+    operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    """
+    Similarity of a string to the most similar part of an expression's words.
+    """
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
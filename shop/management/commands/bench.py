@@ -0,0 +1,145 @@
+import datetime
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from shop.benchmark import ENDPOINTS, compare, run_benchmark, run_concurrency_benchmark, run_renderer_benchmark
+from shop.models import Product
+from shop.recommendations import refresh_all_recommendations
+from shop.seed import seed_catalog
+
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+
+class Command(BaseCommand):
+    help = 'Seeds a catalog in the test database and reports latency and SQL cost per API endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES, default='1k', help='Number of products to seed')
+        parser.add_argument('--users', type=int, help='Number of users to seed (default: products / 10)')
+        parser.add_argument('--orders', type=int, help='Number of orders to seed (default: products)')
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per endpoint')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, dest='endpoints',
+                            help='Endpoint to benchmark, may be repeated (default: all)')
+        parser.add_argument('--cold', action='store_true', help='Clear the catalog cache before every request')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the seeded test database and reuse it on the next run')
+        parser.add_argument('--concurrency', type=int,
+                            help='Also compare read endpoints under this many simultaneous clients between '
+                                 'WSGI and ASGI')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='WSGI sync workers in the concurrency comparison')
+        parser.add_argument('--renderers', action='store_true',
+                            help='Also compare the JSON renderer and parser with DRF\'s on product and order lists')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare the results with a JSON file from an earlier run')
+        parser.add_argument('--max-regression', type=float,
+                            help='Fail if any compared metric is this fraction worse than the baseline')
+
+    def handle(self, *args, **options):
+        products = SIZES[options['size']]
+        users = options['users'] if options['users'] is not None else products // 10
+        orders = options['orders'] if options['orders'] is not None else products
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            if Product.objects.count() != products:
+                self.stdout.write(f'Seeding {products} products, {users} users and {orders} orders...')
+                call_command('flush', interactive=False, verbosity=0)
+                seed_catalog(products=products, users=users, orders=orders)
+                refresh_all_recommendations()
+
+            results = {
+                'meta': {
+                    'date': datetime.datetime.utcnow().isoformat(),
+                    'products': products,
+                    'users': users,
+                    'orders': orders,
+                    'cold': options['cold'],
+                },
+                'endpoints': run_benchmark(options['endpoints'], requests=options['requests'],
+                                            warmup=options['warmup'], cold=options['cold']),
+            }
+            if options['concurrency']:
+                results['concurrency'] = run_concurrency_benchmark(
+                    options['endpoints'], concurrency=options['concurrency'],
+                    requests=max(options['requests'], options['concurrency']), workers=options['workers'])
+            if options['renderers']:
+                results['renderers'] = run_renderer_benchmark()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results['endpoints'])
+        if 'concurrency' in results:
+            self.report_concurrency(results['concurrency'], options['concurrency'], options['workers'])
+        if 'renderers' in results:
+            self.report_renderers(results['renderers'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if baseline is not None:
+            self.report_comparison(results['endpoints'], baseline['endpoints'], options['max_regression'])
+
+    def report(self, endpoints):
+        self.stdout.write(f'{"endpoint":<16}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+                          f'{"req/s":>10}{"queries":>10}{"query ms":>10}{"errors":>8}')
+        for name, result in endpoints.items():
+            self.stdout.write(f'{name:<16}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                              f'{result["p99_ms"]:>10.2f}{result["throughput_rps"]:>10.1f}'
+                              f'{result["queries_per_request"]:>10.1f}{result["query_ms_per_request"]:>10.2f}'
+                              f'{result["errors"]:>8}')
+            if 'hash_ms_mean' in result:
+                self.stdout.write(f'{"":<16}password hashing: {result["hash_ms_mean"]:.2f} ms, waited '
+                                  f'{result["hash_wait_ms_mean"]:.2f} ms, at most {result["hash_max_waiting"]} '
+                                  f'waiting, {result["hash_rejected"]} rejected')
+
+    def report_concurrency(self, endpoints, concurrency, workers):
+        self.stdout.write('')
+        self.stdout.write(f'{concurrency} concurrent clients, {workers} WSGI workers vs one ASGI process')
+        self.stdout.write(f'{"endpoint":<16}{"server":<8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+                          f'{"req/s":>10}{"errors":>8}')
+        for name, servers in endpoints.items():
+            for server, result in servers.items():
+                self.stdout.write(f'{name:<16}{server:<8}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                                  f'{result["p99_ms"]:>10.2f}{result["throughput_rps"]:>10.1f}{result["errors"]:>8}')
+
+    def report_renderers(self, payloads):
+        self.stdout.write('')
+        self.stdout.write(f'{"payload":<16}{"rows":>6}{"bytes":>10}{"render ms":>12}{"fast":>8}'
+                          f'{"parse ms":>12}{"fast":>8}{"identical":>11}')
+        for name, result in payloads.items():
+            self.stdout.write(f'{name:<16}{result["rows"]:>6}{result["bytes"]:>10}{result["render_drf_ms"]:>12.2f}'
+                              f'{result["render_fast_ms"]:>8.2f}{result["parse_drf_ms"]:>12.2f}'
+                              f'{result["parse_fast_ms"]:>8.2f}{str(result["identical"]):>11}')
+
+    def report_comparison(self, endpoints, baseline, max_regression):
+        regressions = []
+        self.stdout.write('')
+        for name, metric, before, after, change in compare(endpoints, baseline):
+            line = f'{name:<16}{metric:<22}{before:>10.2f} -> {after:>10.2f} ({change:+.1%})'
+            if max_regression is not None and change > max_regression:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} metrics regressed more than {max_regression:.0%}')
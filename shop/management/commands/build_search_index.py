@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.search import build_segment
+
+
+class Command(BaseCommand):
+    help = 'Builds the inverted search index of the catalog and writes it to SEARCH_INDEX_PATH'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=getattr(settings, 'SEARCH_INDEX_PATH', None),
+                            help='File to write the index to (default: SEARCH_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Set SEARCH_INDEX_PATH or pass --output')
+
+        segment = build_segment()
+        segment.save(options['output'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(segment)} products, {len(segment.terms)} terms into {options["output"]}'))
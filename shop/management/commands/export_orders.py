@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import FORMATS, export_orders, parse_bound
+
+
+class Command(BaseCommand):
+    help = 'Writes orders with their items as CSV or NDJSON without loading them all in memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--start', help='First date or datetime to include')
+        parser.add_argument('--end', help='Last date to include, or datetime to stop before')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_bound(options['start']) if options['start'] else None
+            end = parse_bound(options['end'], end=True) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        lines = export_orders(options['format'], start, end, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.seed import seed_catalog
+
+
+class Command(BaseCommand):
+    help = 'Bulk generates a synthetic catalog with users and orders for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, help='Number of users (default: products / 10)')
+        parser.add_argument('--orders', type=int, help='Number of orders (default: products)')
+        parser.add_argument('--no-images', action='store_true', help="Don't attach placeholder images")
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per COPY or bulk insert')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        products = options['products']
+        users = options['users'] if options['users'] is not None else products // 10
+        orders = options['orders'] if options['orders'] is not None else products
+
+        start = time.perf_counter()
+        seed_catalog(products=products, users=users, orders=orders, images=not options['no_images'],
+                     batch_size=options['batch_size'], seed=options['seed'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {products} products, {users} users and {orders} orders in {elapsed:.1f}s'
+        ))
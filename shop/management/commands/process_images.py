@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop.images import get_pool, render_derivatives, store_derivatives
+from shop.models import ImageSet
+
+
+class Command(BaseCommand):
+    help = 'Generates the sized images of every image set whose source image has not been processed'
+
+    def handle(self, *args, **options):
+        pending = [image_set for image_set in ImageSet.objects.exclude(source='')
+                    if image_set.needs_derivatives()]
+        sources = [image_set.source.name for image_set in pending]
+
+        for image_set, derivatives in zip(pending, get_pool().map(render_derivatives, sources)):
+            store_derivatives(image_set.pk, image_set.source.name, derivatives)
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(pending)} image sets'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import refresh_all_recommendations, refresh_recommendations_incrementally
+
+
+class Command(BaseCommand):
+    help = 'Refreshes stored product recommendations from orders placed since the last refresh'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every product, including category bestseller fallbacks')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            refreshed = refresh_all_recommendations()
+        else:
+            refreshed = refresh_recommendations_incrementally()
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed recommendations for {refreshed} products'))
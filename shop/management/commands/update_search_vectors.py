@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Backfills the stored search vector of every product in batches of primary keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of products updated per UPDATE statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pks = Product.objects.order_by('pk').values_list('pk', flat=True)
+
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+
+            updated += Product.objects.filter(pk__gte=batch[0], pk__lte=batch[-1]).update_search_vector()
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Updated search vectors for {updated} products'))
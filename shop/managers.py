@@ -1,13 +1,114 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.postgres.search import SearchVector
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, OuterRef, QuerySet, Subquery, Sum, TextField, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from . import models
+from .cache import bump_catalog_version
+
+
+def product_search_vector(name='name', description='description'):
+    """
+    Builds the weighted search vector stored in Product.search_vector.
+
+    `name` and `description` may be field names or expressions, so the same
+    weighting is used for inserts, saves and queryset updates.
+    """
+    return SearchVector(name, weight='A') + SearchVector(description, weight='B')
+
+
+class ProductQuerySet(QuerySet):
+    """
+    QuerySet for products that keeps the stored search vector, the modification time and
+    the catalog cache version current on bulk writes, which don't send model signals.
+    """
+    def update_search_vector(self):
+        """
+        Recomputes the stored search vector for every product in the queryset.
+        """
+        return super().update(search_vector=product_search_vector())
+
+    def update(self, **kwargs):
+        if 'name' in kwargs or 'description' in kwargs:
+            # Build the vector from the new values so it's written in the same UPDATE
+            sources = {}
+            for field in ('name', 'description'):
+                value = kwargs.get(field, field)
+                if field in kwargs and not hasattr(value, 'resolve_expression'):
+                    value = Value(value, output_field=TextField())
+                sources[field] = value
+            kwargs['search_vector'] = product_search_vector(**sources)
+        kwargs.setdefault('updated_at', timezone.now())
+
+        carts = None
+        if 'price' in kwargs:
+            carts = list(models.Cart.objects.filter(items__product__in=self.values('pk'))
+                            .values_list('pk', flat=True).distinct())
+
+        rows = super().update(**kwargs)
+        if carts:
+            models.Cart.objects.filter(pk__in=carts).recalculate_totals()
+        transaction.on_commit(bump_catalog_version)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        pks = [obj.pk for obj in objs if obj.pk is not None]
+        if pks:
+            self.model.objects.filter(pk__in=pks).update_search_vector()
+        transaction.on_commit(bump_catalog_version)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+
+        changes = {}
+        if 'name' in fields or 'description' in fields:
+            changes['search_vector'] = product_search_vector()
+        self.model.objects.filter(pk__in=[obj.pk for obj in objs]).update(**changes)
+        return rows
+
+
+class CartQuerySet(QuerySet):
+
+    def recalculate_totals(self):
+        """
+        Recomputes the subtotal and item count of every cart in the queryset from its
+        lines, e.g. after the price of products in them changed.
+        """
+        lines = models.CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        subtotal = lines.annotate(total=Sum(F('quantity') * F('product__price'), output_field=DecimalField()))
+        item_count = lines.annotate(count=Sum('quantity'))
+        return self.update(
+            subtotal=Coalesce(Subquery(subtotal.values('total')), Value(0), output_field=DecimalField()),
+            item_count=Coalesce(Subquery(item_count.values('count')), Value(0), output_field=IntegerField()),
+        )
+
+
+class UserQuerySet(QuerySet):
+    """
+    QuerySet for users that drops cached users on bulk updates, e.g. of is_active,
+    which don't send model signals.
+    """
+    def update(self, **kwargs):
+        from .authentication import user_cache
+
+        rows = super().update(**kwargs)
+        user_cache.clear()
+        return rows
+
 
 class CustomUserManager(BaseUserManager):
     """
     Custom user model manager where email is the unique identifiers
     for authentication instead of usernames.
     """
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
+
     def create_user(self, email, password, **extra_fields):
         """
         Create and save a User with the given email and password.
@@ -18,8 +119,6 @@ class CustomUserManager(BaseUserManager):
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save()
-        user.cart = models.Cart.objects.create(user=user)
-        user.cart.save()
         return user
 
     def create_superuser(self, email, password, **extra_fields):
@@ -34,4 +133,4 @@ class CustomUserManager(BaseUserManager):
             raise ValueError(_('Superuser must have is_staff=True.'))
         if extra_fields.get('is_superuser') is not True:
             raise ValueError(_('Superuser must have is_superuser=True.'))
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
@@ -0,0 +1,168 @@
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+
+# Levels per content type, gzip from 1 to 9 and brotli from 0 to 11
+DEFAULT_LEVELS = {
+    'application/json': {'br': 5, 'gzip': 6},
+    # Exports are large and streamed, faster levels keep them from being CPU bound
+    'application/x-ndjson': {'br': 4, 'gzip': 4},
+    'text/csv': {'br': 4, 'gzip': 4},
+    'text/html': {'br': 5, 'gzip': 6},
+}
+
+
+class GzipCompressor:
+
+    def __init__(self, level):
+        # A gzip header and trailer, with no file name and a zero modification time
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level, mode=brotli.MODE_TEXT)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def get_compressors():
+    """
+    Returns the compressor of each content coding the server supports, by preference.
+    """
+    compressors = {}
+    if brotli is not None:
+        compressors['br'] = BrotliCompressor
+    compressors['gzip'] = GzipCompressor
+    return compressors
+
+
+def accepted_encodings(header):
+    """
+    Returns the quality value of each content coding in an Accept-Encoding header.
+    """
+    qualities = {}
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def negotiate_encoding(header, encodings):
+    """
+    Returns the coding of `encodings` the client prefers, the first one on ties, or None
+    if it accepts none of them.
+    """
+    qualities = accepted_encodings(header)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_sequence(chunks, compressor):
+    """
+    Compresses a streamed body as it's consumed. Compressed data is yielded whenever the
+    compressor has some, so small chunks, like the lines of an export, still compress
+    as well as the whole body would.
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def weaken_etag(response):
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with brotli, when it's installed, or gzip, whichever the
+    client prefers, at the level the COMPRESSION setting gives their content type.
+    Types without levels, like images, are sent as they are, and so are responses
+    smaller than MIN_SIZE, which wouldn't get through any faster. Streamed responses
+    are compressed chunk by chunk as they're sent.
+
+    Responses of a type with levels say in Vary that they depend on Accept-Encoding,
+    and get a weak ETag, which conditional requests still match against the view's
+    ETag, when the client accepts a coding. Small ones do too, so a 304 sends the same
+    validators as its 200 without knowing its size. A 304 has no content type, so it's
+    only changed when conditional_response recorded the type of its 200. The catalog
+    cache keeps data rather than bodies, so one entry serves every content coding.
+    """
+    def process_response(self, request, response):
+        options = getattr(settings, 'COMPRESSION', {})
+        if response.status_code == 304:
+            content_type = getattr(response, 'representation_type', '')
+        else:
+            content_type = response.get('Content-Type', '')
+        levels = options.get('LEVELS', DEFAULT_LEVELS).get(content_type.split(';')[0].strip().lower())
+        if levels is None or response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressors = get_compressors()
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                                      [encoding for encoding in compressors if encoding in levels])
+        if encoding is None or 'no-transform' in response.get('Cache-Control', ''):
+            return response
+
+        weaken_etag(response)
+        if response.status_code == 304:
+            return response
+
+        min_size = options.get('MIN_SIZE', DEFAULT_MIN_SIZE)
+        if response.streaming:
+            if response.has_header('Content-Length') and int(response['Content-Length']) < min_size:
+                return response
+        elif len(response.content) < min_size:
+            return response
+
+        compressor = compressors[encoding](levels[encoding])
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, compressor)
+            del response['Content-Length']
+        else:
+            response.content = compressor.compress(response.content) + compressor.finish()
+            response['Content-Length'] = str(len(response.content))
+
+        response['Content-Encoding'] = encoding
+        return response
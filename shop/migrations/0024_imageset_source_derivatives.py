@@ -0,0 +1,54 @@
+# Generated by Django 3.0.1 on 2026-10-18 18:33
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageset',
+            name='derivatives',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='imageset',
+            name='img100x100_webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/'),
+        ),
+        migrations.AddField(
+            model_name='imageset',
+            name='img1920x1080_webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/'),
+        ),
+        migrations.AddField(
+            model_name='imageset',
+            name='img690x400_webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/'),
+        ),
+        migrations.AddField(
+            model_name='imageset',
+            name='source',
+            field=models.ImageField(blank=True, upload_to='images/sources/'),
+        ),
+        migrations.AlterField(
+            model_name='imageset',
+            name='img100x100',
+            field=models.ImageField(blank=True, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='imageset',
+            name='img1920x1080',
+            field=models.ImageField(blank=True, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='imageset',
+            name='img690x400',
+            field=models.ImageField(blank=True, upload_to='images/'),
+        ),
+    ]
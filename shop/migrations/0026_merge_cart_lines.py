@@ -0,0 +1,45 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+
+
+def merge_cart_lines(apps, schema_editor):
+    """
+    Moves cart items from the Cart.items join table to CartItem.cart, merging lines for
+    the same product, and computes every cart's subtotal and item count.
+    """
+    Cart = apps.get_model('shop', 'Cart')
+    CartItem = apps.get_model('shop', 'CartItem')
+    Through = Cart._meta.get_field('items').remote_field.through
+
+    lines = defaultdict(dict)
+    for cart_id, item in ((row.cart_id, row.cartitem) for row in
+                          Through.objects.select_related('cartitem').order_by('cart_id', 'cartitem_id')):
+        line = lines[cart_id].get(item.product_id)
+        if line is None:
+            item.cart_id = cart_id
+            lines[cart_id][item.product_id] = item
+        else:
+            line.quantity += item.quantity
+
+    kept = [line for cart_lines in lines.values() for line in cart_lines.values()]
+    CartItem.objects.bulk_update(kept, ['cart', 'quantity'])
+    CartItem.objects.filter(cart__isnull=True).delete()
+
+    for cart in Cart.objects.all():
+        cart_lines = CartItem.objects.filter(cart=cart).select_related('product')
+        cart.subtotal = sum((line.quantity * line.product.price for line in cart_lines), Decimal('0.00'))
+        cart.item_count = sum(line.quantity for line in cart_lines)
+        cart.save(update_fields=['subtotal', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0025_cart_lines'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_cart_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.1 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0029_product_price_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recommendationrefresh',
+            name='last_order_id',
+        ),
+        migrations.AddField(
+            model_name='recommendationrefresh',
+            name='orders_before',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
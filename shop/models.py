@@ -1,14 +1,19 @@
 import re
+from decimal import Decimal
 
 from django.contrib import admin
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum, F, FloatField
+from django.db import IntegrityError, models, transaction
+from django.db.models import Sum, F, FloatField, TextField, Value
 from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
-from .managers import CustomUserManager
+from .managers import CartQuerySet, CustomUserManager, ProductQuerySet, product_search_vector
+from .passwords import check_password, make_password
 
 ZIP_PATTERN = re.compile("^\d{5}$")
 
@@ -31,6 +36,22 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    def set_password(self, raw_password):
+        self.password = make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Checks the password on the hashing pool, and stores a new hash when the
+        password hashers or their parameters changed.
+        """
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # A new hash of the same password isn't a password change
+            self._password = None
+            self.save(update_fields=['password'])
+        return check_password(raw_password, self.password, setter)
+
 
 class Wishlist(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -53,35 +74,125 @@ class Product(models.Model):
     on_sale = models.BooleanField(default=False)
     slug = models.SlugField(max_length=255, blank=True, unique=True)
     category = models.IntegerField(default=4, choices=CATEGORIES)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            # Price filters and sorting, with the primary key for keyset pagination
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            # Only the few flagged products, in the order the featured and new lists use
+            models.Index(fields=['id'], name='product_featured_idx', condition=models.Q(featured=True)),
+            models.Index(fields=['id'], name='product_new_idx', condition=models.Q(new=True)),
+            models.Index(fields=['category', 'price', 'id'], name='product_on_sale_idx',
+                         condition=models.Q(on_sale=True)),
+        ]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # auto_now only sets the fields that are saved, and the validators need it
+            update_fields = kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+
+        if update_fields is None or 'name' in update_fields or 'description' in update_fields:
+            # Computed from the instance values so it works for both INSERT and UPDATE
+            self.search_vector = product_search_vector(Value(self.name, output_field=TextField()),
+                                                       Value(self.description, output_field=TextField()))
+            if update_fields is not None:
+                update_fields.add('search_vector')
+
         super().save(*args, **kwargs)
 
+        # The vector is only known to the database; reload it lazily on access
+        if 'search_vector' in self.__dict__:
+            del self.search_vector
+
 
 class CartItem(models.Model):
+    cart = models.ForeignKey('Cart', related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        unique_together = ('cart', 'product')
+
 
 class Cart(models.Model):
+    """
+    A user's cart, with one line per product. `subtotal` and `item_count` are kept current
+    by the methods that change lines, so reading them doesn't touch the lines.
+    """
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    items = models.ManyToManyField('CartItem')
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    objects = CartQuerySet.as_manager()
 
     def get_total(self):
-        total_dict = self.items.aggregate(total=Sum(F('quantity') * F('product__price'),
-                                            output_field=FloatField()))
-        if total_dict.get('total') == None:
-            return 0.0
-        else:
-            return total_dict['total']
+        return float(self.subtotal)
+
+    def add_item(self, product, quantity=1):
+        """
+        Adds quantity of a product to its line, creating the line if there isn't one,
+        and returns the line.
+        """
+        lines = CartItem.objects.filter(cart=self, product=product)
+        with transaction.atomic():
+            if not lines.update(quantity=F('quantity') + quantity):
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(cart=self, product=product, quantity=quantity)
+                except IntegrityError:
+                    # Another request created the line first
+                    lines.update(quantity=F('quantity') + quantity)
+            self._change_totals(product.price, quantity)
+        return lines.select_related('product').get()
+
+    def set_item_quantity(self, item, quantity):
+        with transaction.atomic():
+            old = CartItem.objects.select_for_update().values_list('quantity', flat=True).get(pk=item.pk)
+            CartItem.objects.filter(pk=item.pk).update(quantity=quantity)
+            self._change_totals(item.product.price, quantity - old)
+        item.quantity = quantity
+        return item
+
+    def remove_item(self, item):
+        with transaction.atomic():
+            old = CartItem.objects.select_for_update().values_list('quantity', flat=True).get(pk=item.pk)
+            CartItem.objects.filter(pk=item.pk).delete()
+            self._change_totals(item.product.price, -old)
+
+    def _change_totals(self, price, count):
+        amount = Decimal(price) * count
+        Cart.objects.filter(pk=self.pk).update(subtotal=F('subtotal') + amount, item_count=F('item_count') + count)
+        self.subtotal += amount
+        self.item_count += count
 
 
 class ImageSet(models.Model):
+    """
+    Product images. The sized images are generated from `source` when one is uploaded,
+    with `derivatives` recording the source they came from and their dimensions and sizes.
+    """
     product    = models.OneToOneField(Product, related_name="images", on_delete=models.CASCADE)
-    img100x100 = models.ImageField(upload_to="images/")
-    img690x400 = models.ImageField(upload_to="images/")
-    img1920x1080 = models.ImageField(upload_to="images/")
+    source     = models.ImageField(upload_to="images/sources/", blank=True)
+    img100x100 = models.ImageField(upload_to="images/", blank=True)
+    img690x400 = models.ImageField(upload_to="images/", blank=True)
+    img1920x1080 = models.ImageField(upload_to="images/", blank=True)
+    img100x100_webp = models.ImageField(upload_to="images/", blank=True, editable=False)
+    img690x400_webp = models.ImageField(upload_to="images/", blank=True, editable=False)
+    img1920x1080_webp = models.ImageField(upload_to="images/", blank=True, editable=False)
+    derivatives = JSONField(default=dict, editable=False)
+
+    def needs_derivatives(self):
+        return bool(self.source) and self.derivatives.get('source') != self.source.name
 
 
 class OrderItem(models.Model):
@@ -107,6 +218,12 @@ class Order(models.Model):
     zip = models.CharField(max_length=5, validators=[zip_code_validator])
     country = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date', 'id'], name='order_date_id_idx'),
+            models.Index(fields=['user', 'order_date', 'id'], name='order_user_date_id_idx')
+        ]
+
     def calc_and_set_total(self):
         total_dict = self.items.aggregate(total=Sum(F('quantity') * F('product__price'),
                                             output_field=FloatField()))
@@ -117,4 +234,27 @@ class Order(models.Model):
             total = total_dict['total']
 
         self.total = total
-        self.save()
\ No newline at end of file
+        self.save()
+
+
+class Recommendation(models.Model):
+    """
+    A stored neighbour of a product, ranked from 0 (best) by how often both were bought
+    in the same order, with category bestsellers filling the remaining places.
+    """
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='recommended_for', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'rank')
+
+
+class RecommendationRefresh(models.Model):
+    """
+    Records up to when orders are folded into the stored recommendations: every order
+    placed before `orders_before` was.
+    """
+    orders_before = models.DateTimeField(null=True)
+    refreshed_at = models.DateTimeField(auto_now=True)
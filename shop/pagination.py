@@ -0,0 +1,208 @@
+import base64
+import datetime
+import decimal
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.encoding import force_str
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .filters import product_sort
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite ordering key such as ('-order_date', '-pk').
+
+    The cursor stores the key of the last row of a page, so the next page is found with
+    a range condition on the ordering columns instead of an OFFSET. Every page costs the
+    same no matter how deep it is. The last field of the ordering must be unique.
+    """
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('pk',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self.clean_position(queryset, position)
+
+        ordering = self._flip(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        # One extra row tells us whether there's another page in this direction
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._key(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._key(self.page[0]), reverse=True)
+
+    def decode_cursor(self, request):
+        """
+        Returns the (position, reverse) pair stored in the request's cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = data['p']
+            reverse = bool(data.get('r', False))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def clean_position(self, queryset, position):
+        """
+        Converts the values of a cursor to the types of their ordering fields. Cursors
+        come from clients, so values that don't fit raise NotFound.
+        """
+        opts = queryset.model._meta
+        annotations = queryset.query.annotations
+
+        values = []
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            if name in annotations:
+                model_field = annotations[name].output_field
+            else:
+                model_field = opts.pk if name == 'pk' else opts.get_field(name)
+
+            try:
+                value = model_field.to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, position, reverse):
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(self.base_url, self.cursor_query_param, force_str(encoded, encoding='ascii'))
+
+    def _key(self, obj):
+        if isinstance(obj, dict):
+            return [self._encode_value(obj[field.lstrip('-')]) for field in self.ordering]
+        return [self._encode_value(getattr(obj, field.lstrip('-'))) for field in self.ordering]
+
+    def _encode_value(self, value):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
+
+    def _flip(self, ordering):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+    def _after(self, ordering, position):
+        """
+        Builds the condition for rows that come after `position` in `ordering`, e.g.
+        (a < x) OR (a = x AND b < y) for ('-a', '-b').
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+
+class ProductPagination(KeysetPagination):
+    """
+    Orders products by the `sort` query parameter, or by pk without one.
+    """
+    def get_ordering(self, request, queryset, view):
+        return product_sort(request) or super().get_ordering(request, queryset, view)
+
+
+class SearchPagination(ProductPagination):
+    """
+    Orders ranked searches by (rank, pk) unless they're sorted, and unranked ones by pk.
+    """
+    def get_ordering(self, request, queryset, view):
+        if 'rank' in queryset.query.annotations and product_sort(request) is None:
+            return ('-rank', 'pk')
+        return super().get_ordering(request, queryset, view)
+
+
+class OrderPagination(KeysetPagination):
+    ordering = ('-order_date', '-pk')
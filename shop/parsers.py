@@ -0,0 +1,30 @@
+import io
+
+from django.conf import settings
+
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONParser(JSONParser):
+    """
+    Drop-in replacement for JSONParser that parses UTF-8 bodies with orjson when it's
+    installed. Bodies orjson rejects are handed to JSONParser, so they get the same
+    result or the same error.
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read() if stream is not None else b''
+        try:
+            return orjson.loads(body)
+        except ValueError:
+            # Including orjson.JSONDecodeError, e.g. for integers over 64 bits
+            return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from .exceptions import HashingPoolBusy
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_stats = {'hashes': 0, 'rejected': 0, 'waiting': 0, 'max_waiting': 0, 'wait_ms': 0.0, 'hash_ms': 0.0,
+          'max_hash_ms': 0.0}
+_stats_lock = threading.Lock()
+
+
+class HashingPool:
+    """
+    Runs password hashing, which takes tens of milliseconds of CPU, on at most `workers`
+    threads. The hashers release the GIL, so requests that don't hash keep running.
+
+    A caller waits up to `timeout` seconds for a free worker, then gets HashingPoolBusy,
+    so a burst of logins fails fast instead of occupying every request thread.
+    """
+    def __init__(self, workers, timeout):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+
+    def run(self, function, *args):
+        _record_waiting(1)
+        start = time.perf_counter()
+        acquired = self.slots.acquire(timeout=self.timeout)
+        waited = time.perf_counter() - start
+        _record_waiting(-1)
+        if not acquired:
+            _record('rejected', 1)
+            raise HashingPoolBusy()
+
+        try:
+            start = time.perf_counter()
+            result = self.executor.submit(function, *args).result()
+            _record_hash(waited, time.perf_counter() - start)
+            return result
+        finally:
+            self.slots.release()
+
+
+def get_pool():
+    """
+    Returns the process' hashing pool, sized by the PASSWORD_HASHING setting.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            options = getattr(settings, 'PASSWORD_HASHING', {})
+            _pool = HashingPool(options.get('WORKERS', 2), options.get('QUEUE_TIMEOUT', 1.0))
+        return _pool
+
+
+def make_password(password):
+    """
+    Like django.contrib.auth.hashers.make_password, hashing on the pool.
+    """
+    return get_pool().run(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Like django.contrib.auth.hashers.check_password, verifying on the pool. When the
+    password is correct but was hashed with another hasher or other parameters than
+    the preferred ones, `setter(password)` is called to store a new hash.
+    """
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+
+    preferred = hashers.get_hasher('default')
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = get_pool().run(hasher.verify, password, encoded)
+
+    # Takes as long for a wrong password as for a right one that is rehashed
+    if not is_correct and not hasher_changed and must_update:
+        get_pool().run(hasher.harden_runtime, password, encoded)
+
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+def get_stats():
+    """
+    Returns the hashes run and rejected, the callers waiting now and at most, and the
+    total wait and hash times (ms) since the last reset.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for stat in ('hashes', 'rejected'):
+            _stats[stat] = 0
+        for stat in ('wait_ms', 'hash_ms', 'max_hash_ms'):
+            _stats[stat] = 0.0
+        # Callers waiting now are still waiting
+        _stats['max_waiting'] = _stats['waiting']
+
+
+def _record(stat, value):
+    with _stats_lock:
+        _stats[stat] += value
+
+
+def _record_waiting(change):
+    with _stats_lock:
+        _stats['waiting'] += change
+        _stats['max_waiting'] = max(_stats['max_waiting'], _stats['waiting'])
+
+
+def _record_hash(waited, took):
+    with _stats_lock:
+        _stats['hashes'] += 1
+        _stats['wait_ms'] += waited * 1000
+        _stats['hash_ms'] += took * 1000
+        _stats['max_hash_ms'] = max(_stats['max_hash_ms'], took * 1000)
@@ -0,0 +1,120 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import OrderItem, Product, Recommendation, RecommendationRefresh
+
+TOP_N = 4
+
+# Orders are dated when they're created, before their transaction commits, so only those
+# older than this are known to be visible, and newer ones are left to the next refresh
+COMMIT_LAG = timedelta(minutes=5)
+
+
+def co_purchases(product_ids=None):
+    """
+    Yields (product_id, [(other_id, score), ...]) with the TOP_N products most often
+    bought in the same order, where score is the number of shared orders.
+    """
+    queryset = OrderItem.objects.annotate(other=F('order__items__product_id')) \
+        .filter(~Q(other=F('product_id')))
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+
+    rows = queryset.values('product_id', 'other') \
+        .annotate(score=Count('pk')) \
+        .order_by('product_id', '-score', 'other') \
+        .values_list('product_id', 'other', 'score')
+
+    for product_id, group in groupby(rows.iterator(), key=lambda row: row[0]):
+        yield product_id, [(other, score) for _, other, score in list(group)[:TOP_N]]
+
+
+def category_bestsellers(categories):
+    """
+    Returns {category: [product_id, ...]} with enough of each category's best selling
+    products to fill any product's remaining recommendation places.
+    """
+    rows = Product.objects.filter(category__in=categories) \
+        .annotate(sold=Coalesce(Sum('orderitem__quantity'), 0, output_field=IntegerField())) \
+        .order_by('category', '-sold', 'pk') \
+        .values_list('category', 'pk')
+
+    bestsellers = {}
+    for category, group in groupby(rows.iterator(), key=lambda row: row[0]):
+        bestsellers[category] = [pk for _, pk in list(group)[:2 * TOP_N]]
+    return bestsellers
+
+
+def refresh_recommendations(product_ids=None, batch_size=1000):
+    """
+    Recomputes the stored recommendations of the given products, or of every product.
+    """
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    categories = dict(products.values_list('pk', 'category'))
+
+    neighbours = dict(co_purchases(None if product_ids is None else list(categories)))
+    bestsellers = category_bestsellers(set(categories.values()))
+
+    recommendations = []
+    for product_id, category in categories.items():
+        chosen = neighbours.get(product_id, [])
+        taken = {other for other, _ in chosen} | {product_id}
+        for pk in bestsellers.get(category, []):
+            if len(chosen) >= TOP_N:
+                break
+            if pk not in taken:
+                chosen.append((pk, 0))
+                taken.add(pk)
+
+        recommendations += [
+            Recommendation(product_id=product_id, recommended_id=other, rank=rank, score=score)
+            for rank, (other, score) in enumerate(chosen)
+        ]
+
+    with transaction.atomic():
+        Recommendation.objects.filter(product_id__in=list(categories)).delete()
+        Recommendation.objects.bulk_create(recommendations, batch_size=batch_size)
+
+    return len(categories)
+
+
+def refresh_recommendations_incrementally():
+    """
+    Recomputes the recommendations of products bought since the last refresh and of
+    products that don't have any yet.
+
+    Category bestseller fallbacks of other products are only updated by a full refresh.
+    """
+    orders_before = timezone.now() - COMMIT_LAG
+    # The state is saved with the recommendations, and concurrent refreshes wait for it
+    with transaction.atomic():
+        state, _ = RecommendationRefresh.objects.select_for_update().get_or_create(pk=1)
+
+        bought = OrderItem.objects.filter(order__order_date__lt=orders_before)
+        if state.orders_before is not None:
+            bought = bought.filter(order__order_date__gte=state.orders_before)
+        missing = Product.objects.filter(recommendations__isnull=True).values_list('pk', flat=True)
+        # Both products of every changed co-purchase pair appear in one of the new orders
+        product_ids = set(bought.values_list('product_id', flat=True)) | set(missing)
+
+        refreshed = refresh_recommendations(product_ids) if product_ids else 0
+
+        state.orders_before = orders_before
+        state.save()
+    return refreshed
+
+
+def refresh_all_recommendations():
+    # Orders newer than the lag may not be visible yet, and are folded in again next time
+    orders_before = timezone.now() - COMMIT_LAG
+    with transaction.atomic():
+        refreshed = refresh_recommendations()
+        RecommendationRefresh.objects.update_or_create(pk=1, defaults={'orders_before': orders_before})
+    return refreshed
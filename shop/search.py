@@ -0,0 +1,543 @@
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from .cache import get_catalog_version
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Weights of a word in the name and in the description, Postgres' default weights of A and B
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+MAGIC = b'SHOPIDX2'
+
+WORD = re.compile(r'\w+')
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'will', 'with',
+))
+
+_index = None
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def terms(text):
+    """
+    Lowercased words of `text` without stop words, with plurals folded so 'apples'
+    finds 'apple'.
+    """
+    for word in WORD.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        yield word
+
+
+def analyze(name, description):
+    """
+    Returns ({term: weighted frequency}, weighted length) of a product.
+    """
+    frequencies = {}
+    length = 0.0
+    for text, weight in ((name, NAME_WEIGHT), (description, DESCRIPTION_WEIGHT)):
+        for term in terms(text or ''):
+            frequencies[term] = frequencies.get(term, 0.0) + weight
+            length += weight
+    return frequencies, length
+
+
+class Terms:
+    """
+    Sorted terms encoded as UTF-8 one after another in `text`, where term i is at
+    offsets[i]:offsets[i + 1], and its postings at starts[i]:starts[i + 1]. Unlike a
+    dict, they can be views of a mapped file.
+    """
+    def __init__(self, text, offsets, starts):
+        self.text = text
+        self.offsets = offsets
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term(self, i):
+        return bytes(self.text[self.offsets[i]:self.offsets[i + 1]])
+
+    def postings(self, term):
+        """
+        Returns the (start, end) of the postings of `term`, empty if it isn't one.
+        """
+        # UTF-8 sorts like the code points it encodes, so the bytes are in order too
+        key = term.encode('utf-8')
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.term(low) == key:
+            return self.starts[low], self.starts[low + 1]
+        return 0, 0
+
+    @classmethod
+    def build(cls, terms, end):
+        """
+        Builds the dictionary of [(term, start of its postings)] in term order, where the
+        last term's postings end at `end`.
+        """
+        text = bytearray()
+        offsets = array('q', [0])
+        starts = array('q')
+        for term, start in terms:
+            text += term.encode('utf-8')
+            offsets.append(len(text))
+            starts.append(start)
+        starts.append(end)
+        return cls(bytes(text), offsets, starts)
+
+
+class Segment:
+    """
+    Postings of a set of products in flat arrays: `ids` and `lengths` of the products by
+    position, sorted by primary key, and for every term the slice of `docs` (positions)
+    and `frequencies` for the products it occurs in.
+
+    A segment never changes. A saved one is memory-mapped, terms included, so every
+    worker process reading the same file shares one copy of it. Files are in native
+    byte order.
+    """
+    def __init__(self, ids, lengths, terms, docs, frequencies, total_length, updated_at=None, buffer=None):
+        self.ids = ids
+        self.lengths = lengths
+        self.terms = terms
+        self.docs = docs
+        self.frequencies = frequencies
+        self.total_length = total_length
+        self.updated_at = updated_at
+        # Keeps the mapping open as long as the arrays are views of it
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, pk):
+        i = bisect_left(self.ids, pk)
+        if i < len(self.ids) and self.ids[i] == pk:
+            return i
+        return None
+
+    def postings(self, term):
+        return self.terms.postings(term)
+
+    @classmethod
+    def build(cls, products):
+        """
+        Builds a segment from (pk, name, description, updated_at) rows in primary key order.
+        """
+        ids = array('q')
+        lengths = array('f')
+        postings = {}
+        total_length = 0.0
+        updated_at = None
+        for pk, name, description, modified in products:
+            frequencies, length = analyze(name, description)
+            doc = len(ids)
+            ids.append(pk)
+            lengths.append(length)
+            total_length += length
+            if updated_at is None or modified > updated_at:
+                updated_at = modified
+
+            for term, frequency in frequencies.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = (array('i'), array('f'))
+                entry[0].append(doc)
+                entry[1].append(frequency)
+
+        terms = []
+        docs = array('i')
+        frequencies = array('f')
+        for term in sorted(postings):
+            term_docs, term_frequencies = postings.pop(term)
+            terms.append((term, len(docs)))
+            docs.extend(term_docs)
+            frequencies.extend(term_frequencies)
+
+        return cls(ids, lengths, Terms.build(terms, len(docs)), docs, frequencies, total_length, updated_at)
+
+    def save(self, path):
+        """
+        Writes the segment to `path`, replacing any previous file atomically so processes
+        that mapped it keep reading the old one.
+        """
+        header = json.dumps({
+            'count': len(self.ids),
+            'postings': len(self.docs),
+            'total_length': self.total_length,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'terms': len(self.terms),
+            'text': len(self.terms.text),
+        }, separators=(',', ':')).encode('utf-8')
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.search-index-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                # The 8-byte integers first, so every array is aligned
+                f.write(b'\0' * (-f.tell() % 8))
+                for values in (self.ids, self.terms.offsets, self.terms.starts, self.lengths, self.docs,
+                               self.frequencies, self.terms.text):
+                    f.write(bytes(values))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps a segment saved with `save`. Raises ValueError if the file isn't one.
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a search index')
+        header_length, = struct.unpack_from('<Q', buffer, len(MAGIC))
+        offset = len(MAGIC) + 8
+        header = json.loads(buffer[offset:offset + header_length].decode('utf-8'))
+        offset += header_length
+        offset += -offset % 8
+
+        view = memoryview(buffer)
+        arrays = []
+        for code, size, count in (('q', 8, header['count']), ('q', 8, header['terms'] + 1),
+                                  ('q', 8, header['terms'] + 1), ('f', 4, header['count']),
+                                  ('i', 4, header['postings']), ('f', 4, header['postings']),
+                                  ('B', 1, header['text'])):
+            if offset + size * count > len(buffer):
+                raise ValueError(f'{path} is truncated')
+            arrays.append(view[offset:offset + size * count].cast(code))
+            offset += size * count
+
+        ids, offsets, starts, lengths, docs, frequencies, text = arrays
+        terms = Terms(text, offsets, starts)
+        updated_at = parse_datetime(header['updated_at']) if header['updated_at'] else None
+        return cls(ids, lengths, terms, docs, frequencies, header['total_length'], updated_at, buffer)
+
+
+class InvertedIndex:
+    """
+    BM25 index of product names and descriptions. Products saved since its segment was
+    built are kept in dicts next to it, and the segment's copies of them are skipped,
+    until the next rebuild.
+    """
+    # Changed products kept outside the segment before the index is rebuilt
+    max_changes = 10000
+
+    def __init__(self, segment, version=None):
+        self.segment = segment
+        self.version = version
+        self.updated_at = segment.updated_at
+        self.count = len(segment)
+        self.total_length = segment.total_length
+        self.removed = set()
+        self.changed = {}
+        self.changed_postings = {}
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, pk, name, description):
+        """
+        Indexes a new product or the current name and description of an indexed one.
+        """
+        frequencies, length = analyze(name, description)
+        with self.lock:
+            self._discard(pk)
+            self.changed[pk] = (frequencies, length)
+            for term, frequency in frequencies.items():
+                self.changed_postings.setdefault(term, {})[pk] = frequency
+            self.count += 1
+            self.total_length += length
+
+    def remove(self, pk):
+        with self.lock:
+            self._discard(pk)
+
+    def _discard(self, pk):
+        if pk in self.changed:
+            frequencies, length = self.changed.pop(pk)
+            for term in frequencies:
+                postings = self.changed_postings[term]
+                del postings[pk]
+                if not postings:
+                    del self.changed_postings[term]
+        elif pk not in self.removed:
+            position = self.segment.position(pk)
+            if position is None:
+                return
+            self.removed.add(pk)
+            length = self.segment.lengths[position]
+        else:
+            return
+        self.count -= 1
+        self.total_length -= length
+
+    def search(self, query, limit=1000):
+        """
+        Returns [(pk, score)] of up to `limit` products with every term of the query,
+        best first.
+        """
+        query_terms = set(terms(query))
+        if not query_terms:
+            return []
+
+        segment = self.segment
+        with self.lock:
+            if not self.count:
+                return []
+            average_length = self.total_length / self.count
+
+            postings = []
+            for term in query_terms:
+                start, end = segment.postings(term)
+                changed = self.changed_postings.get(term, {})
+                if start == end and not changed:
+                    return []
+                postings.append((start, end, changed))
+            # The rarest term first, so later terms only look up its matches
+            postings.sort(key=lambda entry: entry[1] - entry[0] + len(entry[2]))
+
+            scores = None
+            for start, end, changed in postings:
+                matches = []
+                # Products replaced since the segment was built only count once
+                df = len(changed)
+                for i in range(start, end):
+                    doc = segment.docs[i]
+                    pk = segment.ids[doc]
+                    if pk in self.removed:
+                        continue
+                    df += 1
+                    if scores is None or pk in scores:
+                        matches.append((pk, segment.frequencies[i], segment.lengths[doc]))
+                for pk, frequency in changed.items():
+                    if scores is None or pk in scores:
+                        matches.append((pk, frequency, self.changed[pk][1]))
+
+                idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+                term_scores = {}
+                for pk, frequency, length in matches:
+                    term_scores[pk] = bm25(idf, frequency, length, average_length)
+                    if scores is not None:
+                        term_scores[pk] += scores[pk]
+                scores = term_scores
+                if not scores:
+                    return []
+
+        return heapq.nlargest(limit, scores.items(), key=lambda hit: (hit[1], -hit[0]))
+
+    def refresh(self):
+        """
+        Catches up with products changed in the database, e.g. by other processes or by
+        bulk updates, once the catalog version moved. Returns True if the index has to be
+        rebuilt because products were deleted elsewhere or too many changed.
+        """
+        version = get_catalog_version()
+        if version == self.version or not self.refresh_lock.acquire(blocking=False):
+            return False
+
+        try:
+            changed = Product.objects.order_by().values_list('pk', 'name', 'description', 'updated_at')
+            if self.updated_at is not None:
+                changed = changed.filter(updated_at__gte=self.updated_at)
+            for pk, name, description, updated_at in changed.iterator(chunk_size=1000):
+                self.add(pk, name, description)
+                if self.updated_at is None or updated_at > self.updated_at:
+                    self.updated_at = updated_at
+            self.version = version
+
+            return len(self.changed) > self.max_changes or Product.objects.count() != self.count
+        finally:
+            self.refresh_lock.release()
+
+
+def bm25(idf, frequency, length, average_length):
+    return idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+
+
+def build_segment():
+    products = Product.objects.order_by('pk').values_list('pk', 'name', 'description', 'updated_at')
+    return Segment.build(products.iterator(chunk_size=10000))
+
+
+def open_index():
+    """
+    Maps the segment saved at SEARCH_INDEX_PATH if there's one, otherwise builds one
+    from the catalog. Changes since the file was written are caught up on first use.
+    """
+    path = getattr(settings, 'SEARCH_INDEX_PATH', None)
+    if path and os.path.exists(path):
+        try:
+            return InvertedIndex(Segment.load(path))
+        except (OSError, ValueError):
+            logger.exception('Could not load the search index from %s', path)
+
+    return rebuild_index(replace=False)
+
+
+def rebuild_index(replace=True):
+    """
+    Builds an index of the current catalog and, with `replace`, makes it the process' index.
+    """
+    global _index
+    version = get_catalog_version()
+    index = InvertedIndex(build_segment(), version)
+    if replace:
+        _index = index
+    return index
+
+
+def _rebuild_in_background():
+    global _rebuilding
+    try:
+        rebuild_index()
+    except Exception:
+        logger.exception('Could not rebuild the search index')
+    finally:
+        connections.close_all()
+        with _lock:
+            _rebuilding = False
+
+
+def get_index():
+    """
+    Returns the process' search index, opening it on first use, which blocks concurrent
+    searches until it's ready. Deletions elsewhere or a long list of changes get the
+    index rebuilt in the background, and the current one is used until then.
+    """
+    global _index, _rebuilding
+    with _lock:
+        if _index is None:
+            _index = open_index()
+        index = _index
+
+    if index.refresh():
+        with _lock:
+            if not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=_rebuild_in_background, daemon=True).start()
+    return index
+
+
+def index_product(product):
+    """
+    Applies a saved product to the index, if this process has one.
+    """
+    index = _index
+    if index is not None:
+        index.add(product.pk, product.name, product.description)
+
+
+def unindex_product(pk):
+    index = _index
+    if index is not None:
+        index.remove(pk)
+
+
+class SearchBackend:
+    """
+    Finds the products matching a search. `search` narrows a Product queryset to the
+    matches, annotated with their relevance as a float `rank`, best first.
+    """
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Prepares the backend for the first search, e.g. by loading an index.
+        """
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Full-text search on Product.search_vector, ranked by ts_rank.
+    """
+    min_rank = 0.2
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(query)
+        return queryset.filter(search_vector=search_query) \
+            .annotate(rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())) \
+            .filter(rank__gte=self.min_rank).order_by('-rank')
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    BM25 search on the in-process inverted index, so ranking doesn't load the database.
+    The best SEARCH_MAX_RESULTS matches are handed to the query with their scores, so
+    filters and pagination still happen in SQL. The schema still needs Postgres, for
+    Product.search_vector and the trigram and JSON columns of other features.
+    """
+    def search(self, queryset, query):
+        hits = get_index().search(query, getattr(settings, 'SEARCH_MAX_RESULTS', 1000))
+        if not hits:
+            return queryset.none()
+
+        rank = Case(*(When(pk=pk, then=Value(score)) for pk, score in hits), output_field=FloatField())
+        return queryset.filter(pk__in=[pk for pk, _ in hits]) \
+            .annotate(rank=Cast(rank, FloatField())).order_by('-rank')
+
+    def warm_up(self):
+        threading.Thread(target=self._open, daemon=True).start()
+
+    def _open(self):
+        try:
+            get_index()
+        except Exception:
+            logger.exception('Could not open the search index')
+        finally:
+            connections.close_all()
+
+
+def get_search_backend():
+    """
+    Returns the backend of product searches, the SEARCH_BACKEND setting.
+    """
+    return import_string(getattr(settings, 'SEARCH_BACKEND', 'shop.search.PostgresSearchBackend'))()
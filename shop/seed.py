@@ -0,0 +1,231 @@
+import datetime
+import io
+import json
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cache import bump_catalog_version
+from .models import ImageSet, Order, OrderItem, Product, User
+
+WORDS = (
+    'apple', 'banana', 'cherry', 'coffee', 'tea', 'juice', 'bread', 'cheese', 'pasta', 'honey',
+    'shirt', 'jacket', 'sweater', 'jeans', 'socks', 'scarf', 'boots', 'sneakers', 'hat', 'gloves',
+    'laptop', 'phone', 'tablet', 'monitor', 'keyboard', 'mouse', 'headphones', 'speaker', 'camera', 'charger',
+    'lamp', 'mug', 'notebook', 'pen', 'backpack', 'wallet', 'umbrella', 'candle', 'blanket', 'pillow',
+)
+
+ADJECTIVES = (
+    'red', 'blue', 'green', 'black', 'white', 'organic', 'classic', 'premium', 'compact', 'wireless',
+    'vintage', 'modern', 'small', 'large', 'light', 'heavy', 'soft', 'smart', 'portable', 'handmade',
+)
+
+# Share of the catalog and median price per category
+CATEGORIES = {
+    1: (0.3, 8),
+    2: (0.3, 40),
+    3: (0.2, 250),
+    4: (0.2, 20),
+}
+
+IMAGE_SIZES = {
+    'img100x100': (100, 100),
+    'img690x400': (690, 400),
+    'img1920x1080': (1920, 1080),
+}
+
+PASSWORD = 'Password1'
+
+MIN_PRICE = Decimal('0.99')
+MAX_PRICE = Decimal('9999.99')
+
+
+def copy_rows(model, fields, rows, batch_size=10000):
+    """
+    Inserts tuples of field values with COPY on PostgreSQL, and with bulk_create batches
+    on other databases. Doesn't run save() or send signals.
+    """
+    if connection.vendor != 'postgresql':
+        batch = []
+        for row in rows:
+            batch.append(model(**dict(zip(fields, row))))
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+        return
+
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    sql = f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN'
+
+    buffer = io.StringIO()
+    count = 0
+    with connection.cursor() as cursor:
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(value) for value in row))
+            buffer.write('\n')
+            count += 1
+            if count >= batch_size:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer = io.StringIO()
+                count = 0
+        if count:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def reserve_ids(model, count):
+    """
+    Returns a range of `count` primary keys that the database won't hand out again.
+    """
+    if count == 0:
+        return range(0)
+
+    if connection.vendor != 'postgresql':
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        return range(last + 1, last + 1 + count)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [model._meta.db_table, model._meta.pk.column])
+        sequence, = cursor.fetchone()
+        cursor.execute('SELECT setval(%s, nextval(%s) + %s - 1)', [sequence, sequence, count])
+        last, = cursor.fetchone()
+    return range(last - count + 1, last + 1)
+
+
+def placeholder_images(pool_size=4):
+    """
+    Returns {field: [name, ...]} of shared placeholder images for each ImageSet field.
+    Storage hashes file names by content, so images stored by an earlier run are reused.
+    """
+    from PIL import Image
+
+    pool = {}
+    for field, (width, height) in IMAGE_SIZES.items():
+        names = []
+        for i in range(pool_size):
+            shade = 90 + 40 * i
+            content = io.BytesIO()
+            Image.new('RGB', (width, height), (shade, shade, shade)).save(content, 'JPEG', quality=70)
+            names.append(default_storage.save(f'images/placeholder-{width}x{height}-{i}.jpg',
+                                              ContentFile(content.getvalue())))
+        pool[field] = names
+    return pool
+
+
+def money(value):
+    """
+    Rounds a price to cents within what Product.price can store.
+    """
+    return min(max(Decimal(value).quantize(Decimal('0.01')), MIN_PRICE), MAX_PRICE)
+
+
+def skewed_index(rng, count, skew=3):
+    """
+    Picks an index in range(count) where low indexes are much more likely, like the
+    popularity of products and the activity of users.
+    """
+    return int(count * rng.random() ** skew)
+
+
+def seed_catalog(products=1000, users=100, orders=1000, images=True, batch_size=10000, seed=0):
+    """
+    Fills the database with a synthetic catalog, users and orders.
+
+    Rows are written with COPY where possible and reference a small pool of shared
+    placeholder images. Every user's password is PASSWORD.
+    """
+    rng = random.Random(seed)
+    sentences = [f'The {rng.choice(ADJECTIVES)} {rng.choice(WORDS)} is {rng.choice(ADJECTIVES)}.'
+                    for _ in range(200)]
+    categories = list(CATEGORIES)
+    weights = [share for share, _ in CATEGORIES.values()]
+
+    image_pool = placeholder_images() if images and products else None
+
+    with transaction.atomic():
+        product_ids = reserve_ids(Product, products)
+        prices = []
+
+        def product_rows():
+            for pk in product_ids:
+                # The primary key makes names, and therefore slugs, unique
+                name = f'{rng.choice(ADJECTIVES).title()} {rng.choice(WORDS).title()} {pk}'
+                category = rng.choices(categories, weights)[0]
+                price = money(rng.lognormvariate(0, 0.8) * CATEGORIES[category][1])
+                on_sale = rng.random() < 0.15
+                list_price = money(price * Decimal(rng.uniform(1.1, 1.5))) if on_sale else price
+                prices.append(price)
+                yield (pk, name, slugify(name), price, list_price,
+                        ' '.join(rng.sample(sentences, rng.randint(4, 12))),
+                        rng.random() < 0.01, rng.random() < 0.05, on_sale, category, created)
+
+        created = timezone.now()
+        copy_rows(Product, ('id', 'name', 'slug', 'price', 'list_price', 'description', 'featured', 'new',
+                            'on_sale', 'category', 'updated_at'), product_rows(), batch_size)
+        Product.objects.filter(pk__gte=product_ids.start, pk__lt=product_ids.stop).update_search_vector()
+
+        if image_pool:
+            copy_rows(ImageSet, ('product_id', 'derivatives', 'source', 'img100x100_webp', 'img690x400_webp',
+                                 'img1920x1080_webp') + tuple(IMAGE_SIZES), (
+                (pk, {}, '', '', '', '') + tuple(rng.choice(image_pool[field]) for field in IMAGE_SIZES)
+                for pk in product_ids
+            ), batch_size)
+
+        user_ids = reserve_ids(User, users)
+        password = make_password(PASSWORD)
+        joined = timezone.now()
+        copy_rows(User, ('id', 'email', 'password', 'first_name', 'last_name', 'is_superuser', 'is_staff',
+                            'is_active', 'date_joined'), (
+            (pk, f'user{pk}@example.com', password, 'Seed', f'User {pk}', False, False, True, joined)
+            for pk in user_ids
+        ), batch_size)
+
+        order_ids = reserve_ids(Order, orders)
+        items = []
+        now = timezone.now()
+
+        def order_rows():
+            for i, pk in enumerate(order_ids):
+                count = min(1 + int(rng.expovariate(0.7)), 10, products)
+                order_products = set()
+                while len(order_products) < count:
+                    order_products.add(skewed_index(rng, products))
+
+                total = Decimal('0.00')
+                for index in order_products:
+                    quantity = 1 if rng.random() < 0.8 else rng.randint(2, 4)
+                    total += prices[index] * quantity
+                    items.append((pk, product_ids[index], quantity))
+
+                user = user_ids[skewed_index(rng, users, 2)] if users and rng.random() < 0.7 else None
+                # Spread over the past year in id order, like real orders
+                order_date = now - datetime.timedelta(days=365 * (1 - (i + 1) / orders))
+                yield (pk, order_date, total, user, 'Seed', 'Order', '1 Main St', 'Apt 1', 'Springfield',
+                        'IL', '62701', 'US')
+
+        if products:
+            copy_rows(Order, ('id', 'order_date', 'total', 'user_id', 'first_name', 'last_name', 'address1',
+                                'address2', 'city', 'region', 'zip', 'country'), order_rows(), batch_size)
+            copy_rows(OrderItem, ('order_id', 'product_id', 'quantity'), items, batch_size)
+
+    bump_catalog_version()
@@ -1,13 +1,18 @@
+from collections import OrderedDict
+
 from django.core.exceptions import ValidationError
-from django.contrib.auth.hashers import check_password
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.contrib.auth.password_validation import validate_password
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
 from . import exceptions
 from . import models
+from .passwords import check_password
 from .models import (
     User,
     Product,
@@ -21,10 +26,14 @@ from .models import (
 class ImageSetSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.ImageSet
-        fields = ['img100x100', 'img690x400', 'img1920x1080']
+        fields = ['img100x100', 'img690x400', 'img1920x1080', 'img100x100_webp', 'img690x400_webp',
+                    'img1920x1080_webp']
 
 
 class ProductSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    With a (fields, image fields) `fieldset` in its context, only those fields are sent.
+    """
     images = ImageSetSerializer(read_only=True)
 
     class Meta:
@@ -37,6 +46,84 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
             'url': {'lookup_field': 'slug'}
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            fields, image_fields = fieldset
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+            if 'images' in self.fields:
+                images = self.fields['images']
+                for name in set(images.fields) - set(image_fields):
+                    images.fields.pop(name)
+
+
+class ProductReadSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for ProductSerializer.
+
+    Renders rows of `Product.objects.values(*ProductReadSerializer.values_fields)` into the
+    same representation without building field objects, and reverses the product URL
+    once per serializer instead of once per product. With a `fieldset` in its context,
+    rows only need the values of its fields, see fieldsets.product_values.
+    """
+    values_fields = ('pk', 'name', 'price', 'list_price', 'description', 'on_sale', 'new', 'featured',
+                        'category', 'slug', 'images__img100x100', 'images__img690x400', 'images__img1920x1080',
+                        'images__img100x100_webp', 'images__img690x400_webp', 'images__img1920x1080_webp')
+    product_fields = ProductSerializer.Meta.fields
+    image_fields = ('img100x100', 'img690x400', 'img1920x1080', 'img100x100_webp', 'img690x400_webp',
+                    'img1920x1080_webp')
+    slug_placeholder = '__slug__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._url_parts = None
+        self._storage = models.ImageSet._meta.get_field('img100x100').storage
+        self._fieldset = None
+
+    def get_fieldset(self):
+        if self._fieldset is None:
+            self._fieldset = self.context.get('fieldset', (self.product_fields, self.image_fields))
+        return self._fieldset
+
+    def get_url_parts(self):
+        if self._url_parts is None:
+            url = reverse('product-detail', kwargs={'slug': self.slug_placeholder},
+                            request=self.context['request'], format=self.context.get('format'))
+            self._url_parts = url.split(self.slug_placeholder, 1)
+        return self._url_parts
+
+    def get_image_url(self, name):
+        if not name:
+            return None
+
+        url = self._storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, row):
+        fields, image_fields = self.get_fieldset()
+
+        ret = OrderedDict()
+        for field in fields:
+            if field == 'images':
+                # Image columns are never null, unless the product has no images
+                images = None
+                if row['images__' + image_fields[0]] is not None:
+                    images = OrderedDict(
+                        (image, self.get_image_url(row['images__' + image])) for image in image_fields
+                    )
+                ret['images'] = images
+            elif field == 'url':
+                url_prefix, url_suffix = self.get_url_parts()
+                ret['url'] = url_prefix + row['slug'] + url_suffix
+            else:
+                ret[field] = row[field]
+        return ret
+
 
 class UserRUDSerializer(serializers.ModelSerializer):
     class Meta:
@@ -102,6 +189,7 @@ class UserListCreateSerializer(serializers.ModelSerializer):
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
+    quantity = serializers.IntegerField(min_value=1, default=1)
 
     class Meta:
         model = CartItem
@@ -113,13 +201,20 @@ class CartItemSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         quantity   = validated_data['quantity']
         product_id = validated_data['product_id']
-        product    = Product.objects.get(pk=product_id)
-        cart       = Cart.objects.get(user_id=self.context['user_id'])
+        product    = Product.objects.only('pk', 'price').get(pk=product_id)
+        cart, _    = Cart.objects.get_or_create(user_id=self.context['user_id'])
 
-        cart_item = CartItem.objects.create(quantity=quantity, product=product)
-        cart_item.cart_set.add(cart)
-        cart_item.save()
-        return cart_item
+        return cart.add_item(product, quantity)
+
+    def update(self, instance, validated_data):
+        if 'quantity' in validated_data:
+            instance.cart.set_item_quantity(instance, validated_data['quantity'])
+        return instance
+
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -128,7 +223,7 @@ class CartSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Cart
-        fields = ['user', 'items', 'total']
+        fields = ['user', 'items', 'total', 'item_count']
 
     def get_total(self, obj):
         return obj.get_total()
@@ -162,59 +257,40 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['total', 'order_date']
 
     def create(self, validated_data):
-        items = validated_data['items']
-        first_name = validated_data['first_name']
-        last_name = validated_data['last_name']
-        address1 = validated_data['address1']
-        address2 = validated_data['address2']
-        city = validated_data['city']
-        region = validated_data['region']
-        zip = validated_data['zip']
-        country = validated_data['country']
+        items = validated_data.pop('items')
 
         if not items:
             raise exceptions.NoItemsException
 
-        productIds = []
-        for item in items:
-            product = None
-            try:
-                id = item['product_id']
-                product = Product.objects.get(pk=id)
-            except:
-                raise exceptions.ItemDoesntExist(f'Product with a product id of {id} does not exist')
-
-            if product.pk in productIds:
-                raise exceptions.ItemAlreadyExists(f'Duplicate items with a product id of {product.pk}')
-            productIds.append(product.pk)
-
-        order = Order.objects.create(
-            first_name=first_name,
-            last_name=last_name,
-            address1=address1,
-            address2=address2,
-            city=city,
-            region=region,
-            zip=zip,
-            country=country,
-            total=0.0
-        )
-
-        orderItems = []
-        for item in items:
-            orderItem = OrderItem.objects.create(
-                product=Product.objects.get(pk=item['product_id']),
-                quantity=item['quantity'],
-                order=order
-            )
-            orderItems.append(orderItem)
-
-        if self.context['request'].user.is_authenticated:
-            order.user = User.objects.get(pk=self.context['user_id'])
-            order.save()
-
-        order.items.set(orderItems)
-        order.calc_and_set_total()
+        productIds = [item['product_id'] for item in items]
+
+        with transaction.atomic():
+            products = Product.objects.only('pk', 'price').in_bulk(productIds)
+
+            seenIds = set()
+            for id in productIds:
+                if id not in products:
+                    raise exceptions.ItemDoesntExist(f'Product with a product id of {id} does not exist')
+                if id in seenIds:
+                    raise exceptions.ItemAlreadyExists(f'Duplicate items with a product id of {id}')
+                seenIds.add(id)
+
+            total = sum(products[item['product_id']].price * item['quantity'] for item in items)
+
+            user_id = None
+            request = self.context['request']
+            if request.user.is_authenticated:
+                user_id = self.context.get('user_id', request.user.pk)
+
+            order = Order.objects.create(total=total, user_id=user_id, **validated_data)
+
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=products[item['product_id']], quantity=item['quantity'])
+                for item in items
+            ])
+
+        # Load the items the way the order will be rendered, instead of one query per item
+        prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('product__images')))
         return order
 
 
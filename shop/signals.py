@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search
+from .cache import bump_catalog_version
+from .images import process_image_set_async
+from .authentication import user_cache
+from .models import Cart, ImageSet, Product, User
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ImageSet)
+@receiver(post_delete, sender=ImageSet)
+def invalidate_catalog_cache(sender, **kwargs):
+    # Not before the commit, or a concurrent request could cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=ImageSet)
+@receiver(post_delete, sender=ImageSet)
+def touch_product(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ImageSet)
+def generate_derivatives(sender, instance, **kwargs):
+    if instance.needs_derivatives():
+        # Only once the upload is committed, so the workers can see it
+        transaction.on_commit(lambda: process_image_set_async(instance))
+
+
+@receiver(post_save, sender=Product)
+def refresh_cart_totals(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'price' in update_fields):
+        Cart.objects.filter(items__product=instance).recalculate_totals()
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'name' in update_fields or 'description' in update_fields:
+        # Rolled back saves must not be searchable
+        transaction.on_commit(lambda: search.index_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search.unindex_product(pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    user_cache.delete(instance.pk)
@@ -0,0 +1,48 @@
+import hashlib
+import os
+import re
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+
+# Matches names given by HashedFileSystemStorage, e.g. images/apple.0123456789ab.jpg
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+
+def is_hashed_name(name):
+    return HASHED_NAME.search(name) is not None
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    File system storage that adds a hash of the content to every file name.
+
+    A name always refers to the same bytes, so its URL can be cached forever by
+    browsers and proxies. Saving content that is already stored returns the existing
+    name instead of writing a copy.
+    """
+    hash_length = 12
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def hashed_name(self, name, content):
+        md5 = hashlib.md5()
+        for chunk in content.chunks():
+            md5.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        root, ext = os.path.splitext(name)
+        # Don't stack hashes when a hashed name is saved again
+        if is_hashed_name(name):
+            root = os.path.splitext(root)[0]
+        return f'{root}.{md5.hexdigest()[:self.hash_length]}{ext}'
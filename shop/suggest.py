@@ -0,0 +1,162 @@
+import logging
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, Case, Q, Value, When
+
+from .cache import get_catalog_version
+from .lookups import TrigramWordSimilarity
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+MIN_LENGTH = 2
+MAX_LIMIT = 20
+
+WORD = re.compile(r'\w+')
+
+_index = None
+_building = False
+_lock = threading.Lock()
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+class PrefixIndex:
+    """
+    Sorted words of every product name, for finding the products with a word starting
+    with each word of a search without querying the database.
+    """
+    # Most entries looked at for one search
+    max_scan = 500
+
+    def __init__(self, products, version=None):
+        self.version = version
+        self.products = {}
+        entries = []
+        for pk, name, slug in products:
+            self.products[pk] = (name, slug)
+            entries += ((word, pk) for word in set(words(name)))
+        entries.sort()
+
+        self.words = [word for word, _ in entries]
+        self.ids = array('q', (pk for _, pk in entries))
+
+    def search(self, term, limit=10):
+        tokens = words(term)
+        if not tokens:
+            return []
+
+        # The longest word has the fewest matches
+        longest = max(tokens, key=len)
+        start = bisect_left(self.words, longest)
+        end = min(start + self.max_scan, len(self.words))
+
+        candidates = set()
+        for i in range(start, end):
+            if not self.words[i].startswith(longest):
+                break
+            candidates.add(self.ids[i])
+
+        term = term.lower()
+        results = []
+        others = [token for token in tokens if token != longest]
+        for pk in candidates:
+            name, slug = self.products[pk]
+            if others:
+                name_words = words(name)
+                if not all(any(word.startswith(token) for word in name_words) for token in others):
+                    continue
+            results.append((not name.lower().startswith(term), len(name), pk, name, slug))
+
+        results.sort()
+        return [{'pk': pk, 'name': name, 'slug': slug} for _, _, pk, name, slug in results[:limit]]
+
+
+def build_prefix_index(version=None):
+    products = Product.objects.order_by().values_list('pk', 'name', 'slug')
+    return PrefixIndex(products.iterator(chunk_size=10000), version)
+
+
+def rebuild_prefix_index():
+    """
+    Replaces the prefix index with one of the current catalog.
+    """
+    global _index
+    _index = build_prefix_index(get_catalog_version())
+    return _index
+
+
+def _rebuild_in_background():
+    global _building
+    try:
+        rebuild_prefix_index()
+    except Exception:
+        logger.exception('Could not build the search suggestion index')
+    finally:
+        connections.close_all()
+        with _lock:
+            _building = False
+
+
+def get_prefix_index():
+    """
+    Returns the prefix index, or None until the first one is built. When the catalog
+    changed since it was built, it's rebuilt in the background and the old one is
+    returned until then.
+    """
+    global _building
+    with _lock:
+        index = _index
+        if (index is None or index.version != get_catalog_version()) and not _building:
+            _building = True
+            threading.Thread(target=_rebuild_in_background, daemon=True).start()
+    return index
+
+
+def suggest_from_database(term, limit=10):
+    """
+    Products with a name that has words starting with every word of the term, then
+    products with a word similar to the term, most similar first. Both conditions use
+    the trigram index on Product.name.
+    """
+    tokens = words(term)
+    if not tokens:
+        return []
+
+    prefix = Q()
+    for token in tokens:
+        prefix &= Q(name__iregex=r'\m' + re.escape(token))
+
+    return list(Product.objects.filter(prefix | Q(name__trigram_word_similar=term))
+                .annotate(prefix=Case(When(prefix, then=Value(True)), default=Value(False),
+                                      output_field=BooleanField()),
+                          similarity=TrigramWordSimilarity(term, 'name'))
+                .order_by('-prefix', '-similarity', 'pk')
+                .values('pk', 'name', 'slug')[:limit])
+
+
+def suggest(term, limit=10):
+    """
+    Returns up to `limit` products for autocompleting a search term. Prefix matches
+    come from the in-memory index when SEARCH_SUGGEST_INDEX is on, and the database
+    is asked for typo-tolerant matches when it has none.
+    """
+    term = term.strip()
+    if len(term) < MIN_LENGTH:
+        return []
+
+    if getattr(settings, 'SEARCH_SUGGEST_INDEX', False):
+        index = get_prefix_index()
+        if index is not None:
+            results = index.search(term, limit)
+            if results:
+                return results
+
+    return suggest_from_database(term, limit)
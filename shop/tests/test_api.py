@@ -1,14 +1,62 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
 from django.test import SimpleTestCase
 
-from rest_framework.test import APIRequestFactory
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from ..models import User, Product, CartItem
+from .. import cache, passwords, search
+from ..authentication import UserCache, user_cache
+from ..asgi import is_read
+from ..carts import get_anonymous_store
+from ..exports import export_orders
+from ..middleware import CompressionMiddleware, brotli, negotiate_encoding
+from ..parsers import FastJSONParser
+from ..renderers import FastJSONRenderer
+from ..models import User, Product, Cart, CartItem, ImageSet, Order, OrderItem
+from ..recommendations import refresh_all_recommendations
+from ..suggest import build_prefix_index, rebuild_prefix_index
+from ..serializers import OrderSerializer, ProductSerializer, ProductReadSerializer
 from ..views  import UserListCreateView, UserRUDView, CartItemViewSet, OrderViewSet
 
 FACTORY = APIRequestFactory()
 
+
+@contextmanager
+def committed():
+    """
+    Runs the on_commit callbacks registered in the block as if it had been committed,
+    which the transaction of a TestCase never is.
+    """
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
 class APIStatusCodeTests(TestCase):
 
     def setUp(self):
@@ -194,6 +242,94 @@ class TokenAPITest(TestCase):
         response = view(request)
         self.assertEqual(response.status_code, 200)
 
+    def login(self):
+        return self.client.post('/v1/token/', {'email': 'johndoe@gmail.com', 'password': 'password'},
+                                content_type='application/json')
+
+    def test_login_is_rejected_when_hashing_is_busy(self):
+        pool = passwords.HashingPool(workers=1, timeout=0.01)
+        self.addCleanup(setattr, passwords, '_pool', passwords._pool)
+        passwords._pool = pool
+        passwords.reset_stats()
+
+        pool.slots.acquire()
+        try:
+            self.assertEqual(self.login().status_code, 503)
+        finally:
+            pool.slots.release()
+        self.assertEqual(self.login().status_code, 200)
+
+        stats = passwords.get_stats()
+        self.assertEqual((stats['rejected'], stats['hashes'], stats['waiting']), (1, 1, 0))
+        self.assertEqual(stats['max_waiting'], 1)
+
+    def test_login_rehashes_outdated_password(self):
+        self.user.password = make_password('password', hasher='pbkdf2_sha1')
+        self.user.save()
+
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(self.user.check_password('password'))
+        self.assertFalse(self.user.check_password('wrong'))
+
+
+class CachedAuthenticationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(first_name="John", last_name="Doe",
+                                             email="johndoe@gmail.com", password="password")
+        response = self.client.post('/v1/token/', {'email': 'johndoe@gmail.com', 'password': 'password'},
+                                    content_type='application/json')
+        self.auth = {'HTTP_AUTHORIZATION': 'Bearer ' + response.data['access']}
+        user_cache.clear()
+
+    def get_user(self):
+        return self.client.get(f'/v1/users/{self.user.pk}/orders/', **self.auth)
+
+    def test_user_is_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEquals(self.get_user().status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEquals(self.get_user().status_code, 200)
+        self.assertEquals(len(second), len(first) - 1)
+
+    def test_saving_a_user_drops_it(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEquals(self.get_user().status_code, 401)
+
+    def test_bulk_update_drops_users(self):
+        self.get_user()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEquals(self.get_user().status_code, 401)
+
+    def test_cache_is_bounded(self):
+        cache = UserCache(size=1, ttl=60)
+        other = User.objects.create_user(email="janedoe@gmail.com", password="password")
+        cache.set(self.user)
+        cache.set(other)
+        self.assertIsNone(cache.get(self.user.pk))
+        self.assertEquals(cache.get(other.pk).email, "janedoe@gmail.com")
+        self.assertIsNot(cache.get(other.pk), cache.get(other.pk))
+
+        cache = UserCache(size=1, ttl=0)
+        cache.set(self.user)
+        self.assertIsNone(cache.get(self.user.pk))
+
+    def test_cart_rejects_deactivated_and_deleted_users(self):
+        apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+        add = lambda: self.client.post('/v1/cart/items/', {'product_id': apple.pk}, content_type='application/json',
+                                       **self.auth)
+        self.assertEquals(add().status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEquals(add().status_code, 401)
+
+        self.user.delete()
+        self.assertEquals(add().status_code, 401)
+
 
 class RecommendationsAPITest(TestCase):
     
@@ -213,6 +349,12 @@ class RecommendationsAPITest(TestCase):
         response = self.client.get(f'/v1/recommendations?id={self.products[0].pk}')
         self.assertEquals(response.status_code, 200)
 
+    def test_recommendations_are_read_from_stored_neighbours(self):
+        refresh_all_recommendations()
+
+        response = self.client.get(f'/v1/recommendations?id={self.products[0].pk}')
+        self.assertEqual([p['pk'] for p in response.data], [p.pk for p in self.products[1:]])
+
     def test_recommendations_with_no_query_param(self):
         response = self.client.get(f'/v1/recommendations')
         self.assertEquals(response.status_code, 400)
@@ -256,6 +398,31 @@ class OrderAPITest(TestCase):
         response.render()
         self.assertEqual(response.status_code, 201)
     
+    def test_order_total_is_computed_from_product_prices(self):
+        banana = Product.objects.create(name="Banana", price="0.25", description="A yellow banana.")
+        self.data['items'].append({"product_id": f'{banana.pk}', "quantity": "4"})
+        request = FACTORY.post(f'/v1/orders/', self.data, format='json')
+        view = OrderViewSet.as_view({'post': 'create'})
+        response = view(request)
+        response.render()
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.get(pk=response.data['pk'])
+        self.assertEqual(order.total, Decimal('4.00'))
+        self.assertEqual(order.items.count(), 2)
+
+    def test_order_creation_runs_a_constant_number_of_queries(self):
+        self.data['items'] = [{"product_id": Product.objects.create(name=f"Apple {i}", price="1.00",
+                                                                      description="A red apple.").pk,
+                                "quantity": 1} for i in range(20)]
+        request = Request(FACTORY.post(f'/v1/orders/', self.data, format='json'))
+        serializer = OrderSerializer(data=self.data, context={'request': request})
+        self.assertTrue(serializer.is_valid())
+
+        # savepoint, product lookup, order insert, item insert, release, item prefetch
+        with self.assertNumQueries(6):
+            serializer.save()
+
     def test_order_does_not_create_with_bad_product_id(self):
         self.data['items'][0]['product_id'] = -1
         request = FACTORY.post(f'/v1/orders/', self.data, format='json')
@@ -278,4 +445,793 @@ class OrderAPITest(TestCase):
         view = OrderViewSet.as_view({'post': 'create'})
         response = view(request)
         response.render()
-        self.assertEqual(response.status_code, 400)
\ No newline at end of file
+        self.assertEqual(response.status_code, 400)
+
+class SearchAPITest(TestCase):
+
+    def setUp(self):
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.", category=1)
+        self.shirt = Product.objects.create(name="Shirt", price="9.00", description="A red shirt.", category=2)
+
+    def test_search_ranks_name_matches(self):
+        response = self.client.get('/v1/search/?q=apple')
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual([p['pk'] for p in response.data['results']], [self.apple.pk])
+
+    def test_search_with_category(self):
+        response = self.client.get('/v1/search/?q=red&category=2')
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual([p['pk'] for p in response.data['results']], [self.shirt.pk])
+
+    def test_search_facets(self):
+        Product.objects.create(name="Red Hat", price="30.00", description="A red hat.", category=2, on_sale=True)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/v1/search/?q=red&category=2&facets=true')
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+        facets = response.data['facets']
+        # Categories count every category, the other facets only the chosen one
+        self.assertEqual([c['count'] for c in facets['category']], [1, 2, 0, 0])
+        self.assertEqual((facets['on_sale'], facets['new'], facets['featured']), (1, 0, 0))
+        self.assertEqual([b['count'] for b in facets['price']], [1, 0, 1, 0, 0, 0, 0])
+        self.assertEqual((facets['price'][0]['min'], facets['price'][-1]['max']), (0, None))
+
+    def test_search_without_facets(self):
+        response = self.client.get('/v1/search/?q=red')
+        self.assertNotIn('facets', response.data)
+
+
+@override_settings(SEARCH_BACKEND='shop.search.InvertedIndexSearchBackend')
+class InvertedIndexSearchTest(TestCase):
+
+    def setUp(self):
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.", category=1)
+        self.pie = Product.objects.create(name="Pie", price="4.00", description="Baked with apples.", category=1)
+        self.shirt = Product.objects.create(name="Shirt", price="9.00", description="A red shirt.", category=2)
+        self.index = search.rebuild_index()
+        self.addCleanup(setattr, search, '_index', None)
+
+    def pks(self, url):
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return [p['pk'] for p in response.data['results']]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual([pk for pk, _ in self.index.search('apples')], [self.apple.pk, self.pie.pk])
+        self.assertEqual([pk for pk, _ in self.index.search('red apple')], [self.apple.pk])
+        self.assertEqual(self.index.search('the'), [])
+        self.assertEqual(self.index.search('banana'), [])
+
+    def test_search(self):
+        self.assertEqual(self.pks('/v1/search/?q=apple'), [self.apple.pk, self.pie.pk])
+        self.assertEqual(self.pks('/v1/search/?q=red&category=2'), [self.shirt.pk])
+        self.assertEqual(self.pks('/v1/search/?q=banana'), [])
+
+    def test_search_is_paginated_by_rank(self):
+        pks = []
+        url = '/v1/search/?q=apple&page_size=1'
+        while url:
+            response = self.client.get(url)
+            pks += [p['pk'] for p in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(pks, [self.apple.pk, self.pie.pk])
+
+    def test_changes(self):
+        self.index.add(self.shirt.pk, "Apple Shirt", "A red shirt.")
+        self.index.remove(self.pie.pk)
+        self.assertEqual([pk for pk, _ in self.index.search('apple')], [self.apple.pk, self.shirt.pk])
+        self.assertEqual(len(self.index), 2)
+
+        self.index.remove(self.shirt.pk)
+        self.assertEqual([pk for pk, _ in self.index.search('apple')], [self.apple.pk])
+
+    def test_catches_up_with_the_database(self):
+        with committed():
+            self.pie.name = "Apple Pie"
+            self.pie.save()
+            Product.objects.filter(pk=self.shirt.pk).update(description="A shirt with an apple print.")
+
+        self.assertEqual(self.pks('/v1/search/?q=apple'), [self.apple.pk, self.pie.pk, self.shirt.pk])
+
+    def test_saved_segment(self):
+        creme = Product.objects.create(name="Crème brûlée", price="5.00", description="A custard.", category=1)
+        self.index = search.rebuild_index()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'search.idx')
+        search.build_segment().save(path)
+
+        with self.settings(SEARCH_INDEX_PATH=path):
+            index = search.open_index()
+        for query in ('apple', 'red', 'brûlée', 'crème', 'zebra', 'aardvark'):
+            self.assertEqual(index.search(query), self.index.search(query), query)
+        self.assertEqual([pk for pk, _ in index.search('brûlée')], [creme.pk])
+        self.assertEqual(index.updated_at, self.index.updated_at)
+        # The terms are read from the mapping too, rather than copied into each process
+        self.assertIsInstance(index.segment.terms.text, memoryview)
+
+
+class ProductFilterAPITest(TestCase):
+
+    def setUp(self):
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.", category=1)
+        self.shirt = Product.objects.create(name="Red Shirt", price="20.00", description="A shirt.", category=2,
+                                            on_sale=True, featured=True)
+        self.hat = Product.objects.create(name="Red Hat", price="15.00", description="A hat.", category=2,
+                                          featured=True)
+
+    def pks(self, url):
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        if isinstance(response.data, list):
+            return [p['pk'] for p in response.data]
+        pks = [p['pk'] for p in response.data['results']]
+        if response.data['next']:
+            pks += self.pks(response.data['next'])
+        return pks
+
+    def test_price_range(self):
+        self.assertEqual(self.pks('/v1/products/?min_price=10'), [self.shirt.pk, self.hat.pk])
+        self.assertEqual(self.pks('/v1/products/?min_price=10&max_price=15'), [self.hat.pk])
+        self.assertEqual(self.pks('/v1/search/?q=red&max_price=15'), [self.hat.pk, self.apple.pk])
+
+    def test_on_sale_and_category(self):
+        self.assertEqual(self.pks('/v1/products/?on_sale=true'), [self.shirt.pk])
+        self.assertEqual(self.pks('/v1/products/?on_sale=false&category=2'), [self.hat.pk])
+        self.assertEqual(self.pks('/v1/products/featured/?on_sale=false'), [self.hat.pk])
+
+    def test_sort(self):
+        self.assertEqual(self.pks('/v1/products/?sort=price&page_size=1'), [self.apple.pk, self.hat.pk, self.shirt.pk])
+        self.assertEqual(self.pks('/v1/products/?sort=-price&page_size=2'), [self.shirt.pk, self.hat.pk, self.apple.pk])
+        self.assertEqual(self.pks('/v1/products/?sort=newest'), [self.hat.pk, self.shirt.pk, self.apple.pk])
+        self.assertEqual(self.pks('/v1/products/featured/?sort=price'), [self.hat.pk, self.shirt.pk])
+        self.assertEqual(self.pks('/v1/search/?q=red&sort=-price&page_size=1'), [self.shirt.pk, self.hat.pk, self.apple.pk])
+
+    def test_invalid_parameters(self):
+        for query in ('min_price=cheap', 'max_price=-1', 'min_price=1e999999', 'max_price=10000', 'min_price=0.001',
+                      'on_sale=maybe', 'sort=name'):
+            self.assertEquals(self.client.get(f'/v1/products/?{query}').status_code, 400, query)
+            self.assertEquals(self.client.get(f'/v1/search/?q=red&{query}').status_code, 400, query)
+
+    def test_facets_respect_filters(self):
+        response = self.client.get('/v1/search/?q=red&on_sale=false&facets=true')
+        self.assertEqual([p['pk'] for p in response.data['results']], [self.hat.pk, self.apple.pk])
+        self.assertEqual([c['count'] for c in response.data['facets']['category']], [1, 1, 0, 0])
+        self.assertEqual(response.data['facets']['on_sale'], 1)
+
+
+class SparseFieldsetAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.", category=1)
+        self.pear = Product.objects.create(name="Red Pear", price="2.00", description="A red pear.", category=1)
+        ImageSet.objects.create(product=self.apple, img100x100='images/a.png', img690x400='images/b.png',
+                                img1920x1080='images/c.png')
+        refresh_all_recommendations()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return response.data, ' '.join(query['sql'] for query in queries)
+
+    def test_product_list_fields(self):
+        data, sql = self.get('/v1/products/?fields=name,price,slug&sort=-price&page_size=1')
+        self.assertEqual(data['results'], [{'name': "Red Pear", 'price': Decimal('2.00'), 'slug': 'red-pear'}])
+        self.assertNotIn('description', sql)
+        self.assertNotIn('shop_imageset', sql)
+
+        # The cursor still has the sort values
+        data, _ = self.get(data['next'])
+        self.assertEqual([p['name'] for p in data['results']], ["Apple"])
+
+    def test_expand_images(self):
+        data, sql = self.get('/v1/products/featured/?fields=slug,images.img100x100')
+        self.assertEqual(data, [])
+
+        data, sql = self.get('/v1/products/?fields=name,images.img100x100')
+        self.assertEqual(list(data['results'][0]), ['name', 'images'])
+        self.assertEqual(list(data['results'][0]['images']), ['img100x100'])
+        self.assertIsNone(data['results'][1]['images'])
+        self.assertNotIn('img690x400', sql)
+
+        data, _ = self.get('/v1/products/?fields=name&expand=images')
+        self.assertEqual(len(data['results'][0]['images']), 6)
+
+    def test_search_and_detail_fields(self):
+        data, sql = self.get('/v1/search/?q=red&fields=name,url&page_size=1')
+        self.assertEqual(data['results'], [{'name': "Red Pear", 'url': 'http://testserver/v1/products/red-pear/'}])
+        self.assertNotIn('shop_imageset', sql)
+        data, _ = self.get(data['next'])
+        self.assertEqual([p['name'] for p in data['results']], ["Apple"])
+
+        data, sql = self.get('/v1/products/apple/?fields=pk,name')
+        self.assertEqual(data, {'pk': self.apple.pk, 'name': "Apple"})
+        self.assertNotIn('description', sql)
+
+        data, _ = self.get('/v1/products/apple/?fields=name&expand=images')
+        self.assertEqual(data['images']['img100x100'], 'http://testserver/media/images/a.png')
+
+    def test_recommendations_fields(self):
+        data, sql = self.get(f'/v1/recommendations?id={self.pear.pk}&fields=name,images.img100x100')
+        self.assertEqual(data, [{'name': "Apple", 'images': {'img100x100': 'http://testserver/media/images/a.png'}}])
+        self.assertNotIn('description', sql)
+
+        data, sql = self.get(f'/v1/recommendations?id={self.apple.pk}&fields=name')
+        self.assertEqual(data, [{'name': "Red Pear"}])
+        self.assertNotIn('shop_imageset', sql)
+
+    def test_all_fields_by_default(self):
+        data, _ = self.get('/v1/products/apple/')
+        self.assertEqual(list(data), list(ProductSerializer.Meta.fields))
+        self.assertEqual(len(data['images']), 6)
+
+    def test_unknown_fields(self):
+        for query in ('fields=name,colour', 'fields=images.img50x50', 'fields=name.first', 'expand=reviews'):
+            self.assertEquals(self.client.get('/v1/products/?' + query).status_code, 400, query)
+        self.assertEquals(self.client.get(f'/v1/recommendations?id={self.apple.pk}&fields=x').status_code, 400)
+
+
+class PaginationAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.products = [Product.objects.create(name=f"Apple {i}", price="1.00", description="A red apple.")
+                            for i in range(5)]
+
+    def collect_pages(self, url):
+        pks = []
+        while url:
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            pks += [p['pk'] for p in response.data['results']]
+            url = response.data['next']
+        return pks
+
+    def test_products_are_paginated_by_cursor(self):
+        self.assertEqual(self.collect_pages('/v1/products/?page_size=2'), [p.pk for p in self.products])
+
+    def test_previous_page(self):
+        first = self.client.get('/v1/products/?page_size=2').data
+        second = self.client.get(first['next']).data
+        self.assertIsNone(first['previous'])
+
+        previous = self.client.get(second['previous']).data
+        self.assertEqual(previous['results'], first['results'])
+
+    def test_search_is_paginated_by_rank(self):
+        pks = self.collect_pages('/v1/search/?q=apple&page_size=2')
+        self.assertEqual(sorted(pks), [p.pk for p in self.products])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/v1/products/?cursor=bad')
+        self.assertEquals(response.status_code, 404)
+
+    def test_other_lists_are_not_paginated(self):
+        admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        request = FACTORY.get('/v1/users/')
+        force_authenticate(request, user=admin)
+        response = UserListCreateView.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data], ["admin@example.com"])
+
+    def test_tampered_cursor(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+
+        for url, position in (('/v1/products/', ['abc']), ('/v1/products/', [{'a': 1}]),
+                              ('/v1/products/', [None]), ('/v1/products/?sort=price', ['abc', 1]),
+                              ('/v1/search/?q=apple', [[], 1])):
+            separator = '&' if '?' in url else '?'
+            response = self.client.get(f'{url}{separator}cursor={cursor(position)}')
+            self.assertEquals(response.status_code, 404, position)
+
+    def test_orders_are_paginated_newest_first(self):
+        admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        orders = [Order.objects.create(first_name="d", last_name="d", address1="d", address2="d", city="d",
+                                        region="d", zip="12345", country="d", total=0) for i in range(3)]
+
+        request = FACTORY.get('/v1/orders/?page_size=2')
+        force_authenticate(request, user=admin)
+        response = OrderViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([o['pk'] for o in response.data['results']], [orders[2].pk, orders[1].pk])
+        self.assertIsNotNone(response.data['next'])
+
+
+class CatalogCacheAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        cache.reset_stats()
+        self.product = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+
+    def test_repeated_requests_are_served_from_cache(self):
+        self.client.get('/v1/products/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/v1/products/')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_product_save_invalidates_cache(self):
+        self.client.get(f'/v1/products/{self.product.slug}/')
+
+        with committed():
+            self.product.price = "2.00"
+            self.product.save()
+
+        response = self.client.get(f'/v1/products/{self.product.slug}/')
+        self.assertEqual(response.data['price'], 2.0)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 2})
+
+    def test_every_bump_is_a_new_version(self):
+        versions = {cache.get_catalog_version()}
+        for _ in range(3):
+            versions.add(cache.bump_catalog_version())
+            self.assertEqual(cache.get_catalog_version(), max(versions))
+        self.assertEqual(len(versions), 4)
+
+    def test_queryset_update_invalidates_cache(self):
+        self.client.get('/v1/products/featured/')
+
+        with committed():
+            Product.objects.update(featured=True)
+
+        response = self.client.get('/v1/products/featured/')
+        self.assertEqual([p['pk'] for p in response.data], [self.product.pk])
+
+
+class QueryCountAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.products = []
+        for i in range(5):
+            product = Product.objects.create(name=f"Apple {i}", price="1.00", description="A red apple.",
+                                                category=1, featured=True)
+            ImageSet.objects.create(product=product, img100x100='images/a.png', img690x400='images/b.png',
+                                        img1920x1080='images/c.png')
+            self.products.append(product)
+
+    def test_product_list_queries(self):
+        # catalog validators and products
+        with self.assertNumQueries(2):
+            response = self.client.get('/v1/products/')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertTrue(response.data['results'][0]['images']['img100x100'].endswith('images/a.png'))
+
+    def test_featured_products_queries(self):
+        # catalog validators and products
+        with self.assertNumQueries(2):
+            self.client.get('/v1/products/featured/')
+
+    def test_search_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get('/v1/search/?q=apple')
+
+    def test_recommendations_queries(self):
+        refresh_all_recommendations()
+        with self.assertNumQueries(1):
+            self.client.get(f'/v1/recommendations?id={self.products[0].pk}')
+
+    def test_order_list_queries(self):
+        admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        for i in range(3):
+            order = Order.objects.create(first_name="d", last_name="d", address1="d", address2="d", city="d",
+                                            region="d", zip="12345", country="d", total=0)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+
+        request = FACTORY.get('/v1/orders/')
+        force_authenticate(request, user=admin)
+        with self.assertNumQueries(2):
+            response = OrderViewSet.as_view({'get': 'list'})(request)
+            response.render()
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class ProductReadSerializerTest(TestCase):
+
+    def setUp(self):
+        self.with_images = Product.objects.create(name="Apple", price="1.50", list_price="2.00",
+                                                    description="A red apple.", category=1, on_sale=True)
+        ImageSet.objects.create(product=self.with_images, img100x100='images/a b.png',
+                                    img690x400='images/b.png', img1920x1080='images/c.png')
+        self.without_images = Product.objects.create(name="Pear", price="0.99", description="A pear.")
+
+    def assertRendersLikeProductSerializer(self, url):
+        request = Request(FACTORY.get(url))
+        products = Product.objects.order_by('pk')
+
+        expected = ProductSerializer(products, many=True, context={'request': request}).data
+        actual = ProductReadSerializer(products.values(*ProductReadSerializer.values_fields), many=True,
+                                        context={'request': request}).data
+
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_parity_with_product_serializer(self):
+        self.assertRendersLikeProductSerializer('/v1/products/')
+
+    def test_parity_with_format_override(self):
+        self.assertRendersLikeProductSerializer('/v1/products/?format=json')
+
+
+class ConditionalGetAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.product = Product.objects.create(name="Apple", price="1.00", description="A red apple.", featured=True)
+
+    def test_product_detail_not_modified(self):
+        response = self.client.get(f'/v1/products/{self.product.slug}/')
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(f'/v1/products/{self.product.slug}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+    def test_product_detail_modified_by_save(self):
+        etag = self.client.get(f'/v1/products/{self.product.slug}/')['ETag']
+
+        with committed():
+            self.product.price = "2.00"
+            self.product.save()
+
+        response = self.client.get(f'/v1/products/{self.product.slug}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+
+    def test_product_detail_modified_by_partial_save(self):
+        etag = self.client.get(f'/v1/products/{self.product.slug}/')['ETag']
+
+        with committed():
+            self.product.price = "2.00"
+            self.product.save(update_fields=['price'])
+
+        response = self.client.get(f'/v1/products/{self.product.slug}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_detail_modified_by_images(self):
+        etag = self.client.get(f'/v1/products/{self.product.slug}/')['ETag']
+
+        with committed():
+            ImageSet.objects.create(product=self.product, img100x100='images/a.png', img690x400='images/b.png',
+                                    img1920x1080='images/c.png')
+
+        response = self.client.get(f'/v1/products/{self.product.slug}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+
+    def test_product_list_not_modified_since(self):
+        last_modified = self.client.get('/v1/products/featured/')['Last-Modified']
+
+        response = self.client.get('/v1/products/featured/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+
+    def test_product_list_modified_by_delete(self):
+        Product.objects.create(name="Pear", price="1.00", description="A pear.")
+        etag = self.client.get('/v1/products/')['ETag']
+
+        with committed():
+            Product.objects.get(name="Pear").delete()
+
+        response = self.client.get('/v1/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_product(self):
+        response = self.client.get('/v1/products/missing/')
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class OrderExportAPITest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+        self.pear = Product.objects.create(name="Pear", price="2.00", description="A green pear.")
+
+        self.orders = []
+        for day in (1, 2, 3):
+            order = Order.objects.create(first_name="d", last_name="d", address1="d", address2="d", city="d",
+                                         region="d", zip="12345", country="d", total=3)
+            Order.objects.filter(pk=order.pk).update(order_date=f'2020-01-0{day}T12:00:00Z')
+            OrderItem.objects.create(order=order, product=self.apple, quantity=1)
+            OrderItem.objects.create(order=order, product=self.pear, quantity=1)
+            self.orders.append(order)
+
+    def export(self, query='', user=None):
+        request = FACTORY.get('/v1/orders/export/' + query)
+        force_authenticate(request, user=user or self.admin)
+        return OrderViewSet.as_view({'get': 'export'}, **OrderViewSet.export.kwargs)(request)
+
+    def test_export_csv(self):
+        response = self.export()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'text/csv')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEquals(len(lines), 1 + 2 * len(self.orders))
+        self.assertTrue(lines[0].startswith('order_id,order_date'))
+        self.assertTrue(lines[1].startswith(f'{self.orders[0].pk},2020-01-01T12:00:00+00:00'))
+        self.assertTrue(lines[1].endswith('Apple,1.00,1'))
+
+    def test_export_ndjson_by_date(self):
+        response = self.export('?format=ndjson&start=2020-01-02&end=2020-01-02')
+        self.assertEquals(response['Content-Type'], 'application/x-ndjson')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEquals(len(lines), 1)
+        order = json.loads(lines[0])
+        self.assertEquals(order['pk'], self.orders[1].pk)
+        self.assertEquals([item['product_name'] for item in order['items']], ['Apple', 'Pear'])
+
+    def test_export_loads_items_once_per_chunk(self):
+        with self.assertNumQueries(2):
+            lines = list(export_orders('ndjson', chunk_size=10))
+        self.assertEquals(len(lines), len(self.orders))
+
+    def test_export_errors(self):
+        self.assertEquals(self.export('?format=xml').status_code, 400)
+        self.assertEquals(self.export('?start=yesterday').status_code, 400)
+
+        user = User.objects.create_user(email="user@example.com", password="password")
+        self.assertEquals(self.export(user=user).status_code, 403)
+
+
+class CartStoreAPITest(TestCase):
+
+    def setUp(self):
+        self.apple = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+        self.pear = Product.objects.create(name="Pear", price="2.00", description="A green pear.")
+        self.user = User.objects.create_user(email="johndoe@gmail.com", password="password")
+
+    def add(self, product, quantity=1):
+        return self.client.post('/v1/cart/items/', {'product_id': product.pk, 'quantity': quantity},
+                                content_type='application/json')
+
+    def test_anonymous_cart_is_kept_out_of_the_database(self):
+        response = self.add(self.apple, 2)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('cart', response.cookies)
+
+        self.add(self.apple)
+        self.add(self.pear)
+        self.client.put(f'/v1/cart/items/{self.pear.pk}/', {'quantity': 3}, content_type='application/json')
+
+        response = self.client.get('/v1/cart/')
+        self.assertEquals([(item['product']['pk'], item['quantity']) for item in response.data['items']],
+                            [(self.apple.pk, 3), (self.pear.pk, 3)])
+        self.assertEquals((response.data['total'], response.data['item_count']), (9.0, 6))
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.delete(f'/v1/cart/items/{self.pear.pk}/')
+        self.assertEquals(response.data['item_count'], 3)
+
+    def test_checkout_anonymous_cart(self):
+        self.add(self.apple, 2)
+
+        response = self.client.post('/v1/cart/checkout/', {
+            'first_name': 'John', 'last_name': 'Doe', 'address1': '1 Main St', 'address2': 'Apt 1',
+            'city': 'Springfield', 'region': 'IL', 'zip': '62701', 'country': 'US'
+        }, content_type='application/json')
+
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(Order.objects.get().total, Decimal('2.00'))
+        self.assertEquals(self.client.get('/v1/cart/').data['items'], [])
+        self.assertEquals(self.client.post('/v1/cart/checkout/').status_code, 400)
+
+    def test_checkout_with_bad_body(self):
+        self.add(self.apple, 2)
+        for body in ([1, 2], 3, "3"):
+            response = self.client.post('/v1/cart/checkout/', body, content_type='application/json')
+            self.assertEquals(response.status_code, 400, body)
+        self.assertFalse(Order.objects.exists())
+        self.assertEquals(self.client.get('/v1/cart/').data['item_count'], 2)
+
+    def test_login_moves_anonymous_cart_to_database(self):
+        self.add(self.apple, 2)
+
+        response = self.client.post('/v1/token/', {'email': 'johndoe@gmail.com', 'password': 'password'},
+                                    content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEquals((cart.subtotal, cart.item_count), (Decimal('2.00'), 2))
+
+        auth = {'HTTP_AUTHORIZATION': 'Bearer ' + response.data['access']}
+        self.client.post('/v1/cart/items/', {'product_id': self.apple.pk}, content_type='application/json', **auth)
+        self.assertEquals(self.client.get('/v1/cart/', **auth).data['item_count'], 3)
+
+    def test_login_ignores_invalid_cart_cookie(self):
+        get_anonymous_store().add('short', self.apple, 2)
+        self.client.cookies['cart'] = 'short'
+
+        response = self.client.post('/v1/token/', {'email': 'johndoe@gmail.com', 'password': 'password'},
+                                    content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(Cart.objects.filter(user=self.user, items__isnull=False).exists())
+
+    def test_add_missing_product(self):
+        response = self.client.post('/v1/cart/items/', {'product_id': 0}, content_type='application/json')
+        self.assertEquals(response.status_code, 400)
+        self.assertNotIn('cart', response.cookies)
+
+    def test_set_quantity_with_bad_body(self):
+        for body in ([3], 3, "3"):
+            response = self.client.put(f'/v1/cart/items/{self.apple.pk}/', body, content_type='application/json')
+            self.assertEquals(response.status_code, 400, body)
+
+
+class ASGIHandlerTest(SimpleTestCase):
+
+    def test_read_endpoints_use_the_read_pool(self):
+        self.assertTrue(is_read(FACTORY.get('/v1/search/', {'q': 'apple'})))
+        self.assertTrue(is_read(FACTORY.get('/v1/products/apple/')))
+        self.assertTrue(is_read(FACTORY.get('/v1/recommendations', {'id': 1})))
+        self.assertFalse(is_read(FACTORY.post('/v1/orders/')))
+        self.assertFalse(is_read(FACTORY.get('/v1/orders/')))
+        self.assertFalse(is_read(FACTORY.get('/missing/')))
+
+
+class FastJSONTest(SimpleTestCase):
+
+    data = OrderedDict((
+        ('price', Decimal('19.99')),
+        ('total', [Decimal('0.10'), Decimal('1000'), 0.5, 7]),
+        ('order_date', datetime.datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc)),
+        ('dates', (datetime.date(2020, 1, 2), datetime.time(3, 4, 5), datetime.timedelta(hours=1))),
+        ('id', uuid.UUID(int=1)),
+        ('name', gettext_lazy('Caf\u00e9 \u2028 \U0001f600 "quoted" \\ \n')),
+        ('nested', [{'a': None, 'b': True}, {1: 'int key'}]),
+    ))
+
+    def assertIdentical(self, data, media_type=None):
+        self.assertEqual(FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+    def test_renders_identical_bytes(self):
+        self.assertIdentical(self.data)
+        self.assertIdentical(self.data, 'application/json; indent=4')
+        self.assertIdentical([1e-05, 1e20, 0.0001, 123.456])
+        self.assertIdentical(1e20)
+        self.assertIdentical({'slug': 'free-range-e1', 'hash': '3fa8e91', 'rank': 1.5e-7})
+        self.assertIdentical({'big': 2 ** 70})
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_unsupported_types_raise(self):
+        with self.assertRaises(TypeError):
+            FastJSONRenderer().render({'set': object()})
+
+    def test_parses_like_drf(self):
+        for body in (b'{"a": [1, 2.5, "\\u00e9", null, true], "b": {"c": 1e400}}', b'[18446744073709551616]',
+                     'caf\u00e9'.join('""').encode('utf-8')):
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+
+        for body in (b'{"a": NaN}', b'{', b''):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(body))
+
+
+class CompressionAPITest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        for i in range(20):
+            Product.objects.create(name=f"Apple {i}", price="1.00", description="A red apple. " * 10)
+
+    def compress(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_product_list_gzip(self):
+        plain = self.client.get('/v1/products/')
+        response = self.client.get('/v1/products/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+        self.assertEquals(int(response['Content-Length']), len(response.content))
+        self.assertEquals(gzip.decompress(response.content), plain.content)
+        self.assertEquals(response['ETag'], 'W/' + plain['ETag'])
+
+        response = self.client.get('/v1/products/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], 'W/' + plain['ETag'])
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+
+    def test_not_compressed(self):
+        response = self.client.get('/v1/products/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+
+        response = self.client.get('/v1/products/', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        # Too small to be worth it, with the same validators as a compressed one
+        response = self.client.get('/v1/products/apple-0/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+        not_modified = self.client.get('/v1/products/apple-0/', HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(not_modified.status_code, 304)
+        self.assertEquals(not_modified['ETag'], response['ETag'])
+
+        response = self.compress(HttpResponse(b'x' * 2000, content_type='image/png'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        # A 304 of a type that's never compressed keeps its ETag
+        not_modified = HttpResponseNotModified()
+        not_modified['ETag'] = '"1"'
+        response = self.compress(not_modified)
+        self.assertEquals(response['ETag'], '"1"')
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_negotiation(self):
+        self.assertEquals(negotiate_encoding('gzip;q=0.5, br', ['br', 'gzip']), 'br')
+        self.assertEquals(negotiate_encoding('gzip, br;q=0.5', ['br', 'gzip']), 'gzip')
+        self.assertEquals(negotiate_encoding('*', ['br', 'gzip']), 'br')
+        self.assertEquals(negotiate_encoding('*;q=0, identity', ['br', 'gzip']), None)
+        self.assertEquals(negotiate_encoding('deflate', ['br', 'gzip']), None)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli(self):
+        plain = self.client.get('/v1/products/')
+        response = self.client.get('/v1/products/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEquals(response['Content-Encoding'], 'br')
+        self.assertEquals(brotli.decompress(response.content), plain.content)
+
+    def test_streaming_response(self):
+        lines = [f'{i},Apple,1.00,1\n' for i in range(1000)]
+        response = self.compress(StreamingHttpResponse(iter(lines), content_type='text/csv'))
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+
+        chunks = list(response.streaming_content)
+        self.assertLess(len(chunks), 10)
+        self.assertEquals(gzip.decompress(b''.join(chunks)).decode(), ''.join(lines))
+
+
+class SearchSuggestAPITest(TestCase):
+
+    def setUp(self):
+        self.iphone = Product.objects.create(name="Apple iPhone 12", price="799.00", description="A phone.")
+        self.ipad = Product.objects.create(name="Apple iPad Air", price="599.00", description="A tablet.")
+        self.laptop = Product.objects.create(name="Wireless Laptop Stand", price="29.00", description="A stand.")
+
+    def names(self, query):
+        response = self.client.get('/v1/search/suggest/', {'q': query})
+        self.assertEquals(response.status_code, 200)
+        return [product['name'] for product in response.data]
+
+    def test_prefix(self):
+        self.assertCountEqual(self.names('ip'), ["Apple iPad Air", "Apple iPhone 12"])
+        self.assertEquals(self.names('apple iph')[0], "Apple iPhone 12")
+
+    def test_typo(self):
+        self.assertEquals(self.names('iphnoe'), ["Apple iPhone 12"])
+        self.assertEquals(self.names('laptpo'), ["Wireless Laptop Stand"])
+
+    def test_short_or_bad_query(self):
+        self.assertEquals(self.names('i'), [])
+        response = self.client.get('/v1/search/suggest/', {'q': 'apple', 'limit': 'x'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_prefix_index(self):
+        index = build_prefix_index()
+
+        self.assertEquals([p['name'] for p in index.search('ip')], ["Apple iPad Air", "Apple iPhone 12"])
+        self.assertEquals([p['pk'] for p in index.search('apple ipho')], [self.iphone.pk])
+        self.assertEquals([p['name'] for p in index.search('WIRE', limit=1)], ["Wireless Laptop Stand"])
+        self.assertEquals(index.search('iphnoe'), [])
+
+    def test_suggest_with_prefix_index(self):
+        rebuild_prefix_index()
+
+        with self.settings(SEARCH_SUGGEST_INDEX=True), self.assertNumQueries(0):
+            self.assertEquals(self.names('apple ipa'), ["Apple iPad Air"])
@@ -0,0 +1,83 @@
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from ..benchmark import (ENDPOINTS, compare, percentile, run_benchmark, run_concurrency_benchmark,
+                         run_renderer_benchmark)
+from ..models import ImageSet, Order, Product, User
+from ..seed import seed_catalog
+
+
+class SeedTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def test_seed_catalog(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            seed_catalog(products=50, users=5, orders=20)
+
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(Product.objects.filter(search_vector__isnull=True).count(), 0)
+        self.assertEqual(ImageSet.objects.count(), 50)
+        self.assertEqual(ImageSet.objects.values('img100x100').distinct().count(), 4)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Order.objects.filter(items__isnull=True).count(), 0)
+        self.assertEqual(Order.objects.count(), 20)
+
+    def test_seed_catalog_twice_does_not_collide(self):
+        seed_catalog(products=20, users=2, orders=5, images=False)
+        seed_catalog(products=20, users=2, orders=5, images=False)
+
+        self.assertEqual(Product.objects.values('slug').distinct().count(), 40)
+        self.assertEqual(User.objects.count(), 4)
+
+    def test_new_products_use_the_next_ids(self):
+        seed_catalog(products=5, users=0, orders=0, images=False)
+        product = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+
+        self.assertGreater(product.pk, Product.objects.exclude(pk=product.pk).order_by('-pk')[0].pk)
+
+
+class BenchmarkTest(TestCase):
+
+    def setUp(self):
+        seed_catalog(products=50, users=5, orders=20, images=False)
+
+    def test_run_benchmark_reports_every_endpoint(self):
+        results = run_benchmark(requests=3, warmup=0, cold=True)
+
+        self.assertEqual(set(results), set(ENDPOINTS))
+        for name, result in results.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries_per_request'], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_compare(self):
+        rows = compare({'search': {'p50_ms': 15.0}}, {'search': {'p50_ms': 10.0}, 'token': {'p50_ms': 1.0}})
+        self.assertEqual(rows, [('search', 'p50_ms', 10.0, 15.0, 0.5)])
+
+    def test_run_concurrency_benchmark(self):
+        results = run_concurrency_benchmark(['products', 'search'], concurrency=4, requests=8, workers=2)
+
+        self.assertEqual(set(results), {'products', 'search'})
+        for name, servers in results.items():
+            for server in ('wsgi', 'asgi'):
+                self.assertEqual(servers[server]['requests'], 8, name)
+                self.assertEqual(servers[server]['errors'], 0, name)
+
+    def test_run_renderer_benchmark(self):
+        results = run_renderer_benchmark(count=20, repeat=2)
+
+        self.assertEqual(set(results), {'products', 'orders'})
+        for name, result in results.items():
+            self.assertEqual(result['rows'], 20, name)
+            self.assertTrue(result['identical'], name)
@@ -0,0 +1,127 @@
+import io
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from ecommerce_backend import urls
+
+from ..images import process_image_set, render_derivatives
+from ..models import ImageSet, Product
+from ..storage import is_hashed_name
+
+# The media route is only mounted with DEBUG or MEDIA_SERVE, tests run without either
+urlpatterns = urls.urlpatterns + urls.media_urlpatterns
+
+
+class ImageDerivativeTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.product = Product.objects.create(name="Apple", price="1.00", description="A red apple.")
+
+    def upload(self, width=800, height=600, orientation=None):
+        image = Image.new('RGB', (width, height), (200, 20, 20))
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera maker'
+        if orientation:
+            exif[0x0112] = orientation
+
+        content = io.BytesIO()
+        image.save(content, 'JPEG', exif=exif.tobytes())
+        return default_storage.save('images/sources/apple.jpg', ContentFile(content.getvalue()))
+
+    def test_render_derivatives(self):
+        derivatives = render_derivatives(self.upload())
+
+        self.assertEqual(set(derivatives), {'img100x100', 'img690x400', 'img1920x1080', 'img100x100_webp',
+                                                'img690x400_webp', 'img1920x1080_webp'})
+        for name, derivative in derivatives.items():
+            image = Image.open(io.BytesIO(derivative['content']))
+            self.assertEqual(image.size, (derivative['width'], derivative['height']), name)
+            self.assertNotIn('exif', image.info, name)
+
+    def test_render_derivatives_applies_orientation(self):
+        derivatives = render_derivatives(self.upload(width=600, height=100, orientation=6))
+        self.assertEqual((derivatives['img690x400']['width'], derivatives['img690x400']['height']), (690, 400))
+
+    def test_process_image_set(self):
+        image_set = ImageSet.objects.create(product=self.product, source=self.upload())
+        updated_at = Product.objects.get(pk=self.product.pk).updated_at
+        self.assertTrue(image_set.needs_derivatives())
+
+        process_image_set(image_set)
+
+        image_set.refresh_from_db()
+        self.assertFalse(image_set.needs_derivatives())
+        self.assertEqual(image_set.img1920x1080.width, 1920)
+        self.assertEqual(image_set.img100x100_webp.height, 100)
+        self.assertEqual(image_set.derivatives['img690x400']['bytes'], image_set.img690x400.size)
+        self.assertGreater(Product.objects.get(pk=self.product.pk).updated_at, updated_at)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class HashedStorageTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_save_names_files_by_content(self):
+        first = default_storage.save('images/apple.jpg', ContentFile(b'apple'))
+        again = default_storage.save('images/apple.jpg', ContentFile(b'apple'))
+        other = default_storage.save('images/apple.jpg', ContentFile(b'pear'))
+
+        self.assertTrue(is_hashed_name(first))
+        self.assertRegex(first, r'^images/apple\.[0-9a-f]{12}\.jpg$')
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertEqual(default_storage.save(first, ContentFile(b'apple')), first)
+
+    def test_media_caches_hashed_files_forever(self):
+        name = default_storage.save('images/apple.jpg', ContentFile(b'apple'))
+
+        response = self.client.get(default_storage.url(name))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'apple')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_media_hands_files_to_web_server(self):
+        name = default_storage.save('images/apple.jpg', ContentFile(b'apple'))
+
+        with self.settings(MEDIA_SERVE='x-accel-redirect'):
+            response = self.client.get(default_storage.url(name))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + name)
+        self.assertEqual(response.content, b'')
+
+        with self.settings(MEDIA_SERVE='x-sendfile'):
+            response = self.client.get(default_storage.url(name))
+        self.assertEqual(response['X-Sendfile'], default_storage.path(name))
+
+    def test_media_rejects_paths_outside_media_root(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/images/missing.jpg').status_code, 404)
+
+    def test_media_is_not_mounted_in_production(self):
+        name = default_storage.save('images/apple.jpg', ContentFile(b'apple'))
+        with self.settings(ROOT_URLCONF='ecommerce_backend.urls'):
+            self.assertEqual(self.client.get(default_storage.url(name)).status_code, 404)
+
+    def test_media_hides_image_sources(self):
+        name = default_storage.save('images/sources/apple.jpg', ContentFile(b'apple'))
+        self.assertEqual(self.client.get(default_storage.url(name)).status_code, 404)
+        self.assertEqual(self.client.get('/media/images/../images/sources/' + name.split('/')[-1]).status_code, 404)
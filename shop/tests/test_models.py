@@ -1,7 +1,13 @@
+from datetime import timedelta
+from decimal import Decimal
+
 from django.test import TestCase
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from django.contrib.postgres.search import SearchQuery
 
-from ..models import User, Product, CartItem
+from ..carts import DatabaseCartStore
+from ..models import User, Product, Cart, CartItem, Order, OrderItem, RecommendationRefresh
+from ..recommendations import COMMIT_LAG, refresh_all_recommendations, refresh_recommendations_incrementally
 
 class UserModelTest(TestCase):
 
@@ -9,11 +15,13 @@ class UserModelTest(TestCase):
         self.user = User.objects.create_user(first_name="John", last_name="Doe",
                                                 email="johndoe@gmail.com", password="password")
 
-    def test_user_has_cart_associated_with_it_on_user_creation(self):
-        try:
-            cart = self.user.cart
-        except ObjectDoesNotExist:
-            self.fail("User does not have a cart associated with it on creation")
+    def test_user_cart_is_created_when_first_used(self):
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+        product = Product.objects.create(name="Apple", price="0.99", description="A red apple")
+        DatabaseCartStore().add(self.user.pk, product, 2)
+
+        self.assertEqual(Cart.objects.get(user=self.user).item_count, 2)
 
 
 class CartModelTest(TestCase):
@@ -22,7 +30,7 @@ class CartModelTest(TestCase):
         self.user    = User.objects.create_user(first_name="John", last_name="Doe",
                                                 email="johndoe@gmail.com", password="password")
 
-        self.cart    = self.user.cart
+        self.cart    = Cart.objects.create(user=self.user)
         self.product = Product.objects.create(name="Apple", price="0.99",
                                                 description="A red apple")
 
@@ -31,10 +39,136 @@ class CartModelTest(TestCase):
         #Test that when there are no items in the cart, get_total returns 0.0
         self.assertEqual(self.cart.get_total(), 0.0)
 
-        cartitem_1 = CartItem.objects.create(product=self.product, quantity=2)
-        cartitem_2 = CartItem.objects.create(product=self.product, quantity=3)
+        self.cart.add_item(self.product, 2)
+        self.cart.add_item(self.product, 3)
+
+        self.assertEqual(self.cart.get_total(), 4.95)
+
+    def test_add_item_merges_lines(self):
+        pear = Product.objects.create(name="Pear", price="2.00", description="A green pear")
+
+        line = self.cart.add_item(self.product, 2)
+        self.assertEqual(self.cart.add_item(self.product, 3), line)
+        self.cart.add_item(pear)
+
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity').order_by('pk')),
+                            [(self.product.pk, 5), (pear.pk, 1)])
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.subtotal, cart.item_count), (Decimal('6.95'), 6))
+
+    def test_change_and_remove_items(self):
+        line = self.cart.add_item(self.product, 2)
+
+        self.cart.set_item_quantity(line, 4)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.subtotal, cart.item_count), (Decimal('3.96'), 4))
+
+        self.cart.remove_item(line)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.subtotal, cart.item_count), (Decimal('0.00'), 0))
+        self.assertFalse(cart.items.exists())
+
+    def test_price_changes_update_totals(self):
+        self.cart.add_item(self.product, 2)
+
+        self.product.price = Decimal('1.50')
+        self.product.save()
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).subtotal, Decimal('3.00'))
+
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('2.00'))
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).subtotal, Decimal('4.00'))
+
+class ProductSearchVectorTest(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Apple", price="0.99",
+                                                description="A red apple")
+
+    def search(self, query):
+        return Product.objects.filter(search_vector=SearchQuery(query))
+
+    def test_search_vector_is_set_on_save(self):
+        self.assertEqual(list(self.search('apple')), [self.product])
+
+        self.product.name = "Pear"
+        self.product.description = "A green pear"
+        self.product.save()
+
+        self.assertFalse(self.search('apple').exists())
+        self.assertEqual(list(self.search('pear')), [self.product])
+
+    def test_search_vector_is_set_on_queryset_update(self):
+        Product.objects.filter(name="Apple").update(description="A green fruit")
+
+        self.assertEqual(list(self.search('green')), [self.product])
+        self.assertFalse(self.search('red').exists())
+
+    def test_search_vector_is_set_on_bulk_create(self):
+        pear, = Product.objects.bulk_create([
+            Product(name="Pear", slug="pear", price="1.00", description="A yellow pear")
+        ])
+
+        self.assertEqual(list(self.search('yellow')), [pear])
+
+
+class RecommendationTest(TestCase):
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f"Apple {i}", price="1.00", description="A red apple.",
+                                                    category=1) for i in range(6)]
+
+    def order(self, *products, age=COMMIT_LAG * 2):
+        order = Order.objects.create(first_name="d", last_name="d", address1="d", address2="d", city="d",
+                                        region="d", zip="12345", country="d", total=0)
+        Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - age)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        return order
+
+    def rewind(self):
+        # As if the last refresh ran a while ago, before the orders the test places
+        RecommendationRefresh.objects.update(orders_before=timezone.now() - COMMIT_LAG * 4)
+
+    def recommended(self, product):
+        return [r.recommended for r in product.recommendations.order_by('rank')]
+
+    def test_co_purchases_rank_before_bestsellers(self):
+        apple, pear, plum, fig = self.products[:4]
+        self.order(apple, pear, plum)
+        self.order(apple, plum)
+        self.order(fig, self.products[5])
+
+        refresh_all_recommendations()
+
+        recommended = self.recommended(apple)
+        self.assertEqual(recommended[:2], [plum, pear])
+        self.assertEqual(len(recommended), 4)
+        self.assertNotIn(apple, recommended)
+
+    def test_incremental_refresh_only_updates_bought_products(self):
+        apple, pear = self.products[:2]
+        refresh_all_recommendations()
+        self.rewind()
+        untouched = self.recommended(self.products[3])
+
+        self.order(apple, pear)
+        self.assertEqual(refresh_recommendations_incrementally(), 2)
+
+        self.assertEqual(self.recommended(apple)[0], pear)
+        self.assertEqual(self.recommended(self.products[3]), untouched)
+
+    def test_incremental_refresh_waits_for_recent_orders(self):
+        apple, fig = self.products[0], self.products[5]
+        refresh_recommendations_incrementally()
+        self.rewind()
 
-        self.cart.items.add(cartitem_1)
-        self.cart.items.add(cartitem_2)
+        # Placed just now, so it may not be committed yet
+        late = self.order(apple, fig, age=timedelta(0))
+        self.order(*self.products[2:4])
+        self.assertEqual(refresh_recommendations_incrementally(), 2)
+        self.assertNotIn(fig, self.recommended(apple))
 
-        self.assertEqual(self.cart.get_total(), 4.95)
\ No newline at end of file
+        # Once it settles, it falls after what that refresh folded in
+        Order.objects.filter(pk=late.pk).update(order_date=RecommendationRefresh.objects.get().orders_before)
+        self.assertEqual(refresh_recommendations_incrementally(), 2)
+        self.assertEqual(self.recommended(apple)[0], fig)
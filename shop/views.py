@@ -1,44 +1,137 @@
+import mimetypes
+import os
+import posixpath
 import urllib.parse
 
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramSimilarity, TrigramDistance
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
 
-from rest_framework import generics, viewsets, status
+from rest_framework import generics, permissions, viewsets, status
 
-from rest_framework.decorators import action, api_view
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response   import Response
+from rest_framework.views      import APIView
 
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from .models      import User, Product, Cart, CartItem, Order, OrderItem
+from . import exceptions
+from .carts       import cart_data, get_cart, new_cart_key, persist_cart
+from .exports     import FORMATS, export_orders, parse_bound
+from .facets      import facet_counts, wants_facets
+from .fieldsets   import only_fieldset, product_fieldset, product_values
+from .filters     import product_filters, product_sort
+from .cache       import cache_catalog_response, conditional_response, get_or_compute
+from .models      import User, Product, Cart, CartItem, ImageSet, Order, OrderItem
+from .pagination  import OrderPagination, ProductPagination, SearchPagination
 
 from .permissions import IsAdminOrWriteOnly, UserPermission
+from .recommendations import TOP_N
+from .search      import get_search_backend
+from .suggest     import MAX_LIMIT, suggest
+from .storage import is_hashed_name
 from .serializers import (
     ProductSerializer, 
+    ProductReadSerializer,
     UserRUDSerializer, 
     UserListCreateSerializer, 
     CartSerializer,
     CartItemSerializer,
+    CartLineSerializer,
     OrderSerializer,
     OrderItemSerializer,
     CustomTokenObtainPairSerializer
 )
 
 
+def product_validators(view, request, slug=None, **kwargs):
+    """
+    Validators of a single product from its modification time.
+    """
+    def compute():
+        row = Product.objects.filter(slug=slug).values_list('pk', 'updated_at').first()
+        if row is None:
+            return None, None
+
+        pk, updated_at = row
+        return f'{pk}-{updated_at.timestamp()}', updated_at
+
+    return get_or_compute(f'validators:product:{slug}', compute)
+
+
+def catalog_validators(view, request, *args, **kwargs):
+    """
+    Validators of product lists from the latest modification time and the size of the catalog.
+
+    The count makes the ETag change when a product is deleted, which the Last-Modified
+    time alone can't show.
+    """
+    def compute():
+        catalog = Product.objects.aggregate(count=Count('pk'), updated_at=Max('updated_at'))
+        if catalog['updated_at'] is None:
+            return '0', None
+        return f"{catalog['count']}-{catalog['updated_at'].timestamp()}", catalog['updated_at']
+
+    return get_or_compute('validators:catalog', compute)
+
+
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('images')
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
     lookup_field = 'slug'
+    read_actions = ('list', 'featured', 'new')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.read_actions:
+            queryset = queryset.filter(*product_filters(self.request).values())
+            return queryset.values(*product_values(product_fieldset(self.request), 'pk',
+                                                   *(product_sort(self.request) or ())))
+        if self.action == 'retrieve':
+            return only_fieldset(queryset, product_fieldset(self.request))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.read_actions:
+            return ProductReadSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.read_actions or self.action == 'retrieve':
+            context['fieldset'] = product_fieldset(self.request)
+        return context
+
+    @conditional_response(catalog_validators)
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response(product_validators)
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(methods=['GET'], detail=False)
+    @conditional_response(catalog_validators)
+    @cache_catalog_response
     def featured(self, request, pk=None):
-        q = self.queryset.filter(featured=True)
-        serializer = ProductSerializer(q, many=True, context={'request': request})
+        q = self.get_queryset().filter(featured=True).order_by(*(product_sort(request) or ('pk',)))
+        serializer = self.get_serializer(q, many=True)
         return Response(serializer.data)
 
     @action(methods=['GET'], detail=False)
+    @conditional_response(catalog_validators)
+    @cache_catalog_response
     def new(self, request, pk=None):
-        q = self.queryset.filter(new=True)
-        serializer = ProductSerializer(q, many=True, context={'request': request})
+        q = self.get_queryset().filter(new=True).order_by(*(product_sort(request) or ('pk',)))
+        serializer = self.get_serializer(q, many=True)
         return Response(serializer.data)
 
 
@@ -60,15 +153,18 @@ class CartView(generics.RetrieveAPIView):
     serializer_class = CartSerializer
 
     def get_queryset(self):
-        return Cart.objects.filter(user_id=self.kwargs['pk'])
+        return Cart.objects.filter(user_id=self.kwargs['pk']) \
+            .prefetch_related(Prefetch('items', queryset=CartItem.objects.select_related('product__images')))
 
 
 class CartItemViewSet(viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     
     def get_queryset(self):
-        cart = User.objects.get(pk=self.kwargs['user_pk']).cart
-        return CartItem.objects.filter(cart=cart)
+        return CartItem.objects.filter(cart__user_id=self.kwargs['user_pk']).select_related('cart', 'product__images')
+
+    def perform_destroy(self, instance):
+        instance.cart.remove_item(instance)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -76,20 +172,145 @@ class CartItemViewSet(viewsets.ModelViewSet):
         return context
 
 
+class CurrentCartView(APIView):
+    """
+    The cart of the requesting client: the user's cart in the database, or for anonymous
+    clients, a cart in the anonymous cart store named by the cart cookie.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        store, key = get_cart(request)
+        lines = store.get(key) if key is not None else {}
+        return Response(cart_data(lines, {'request': request}))
+
+
+class CurrentCartItemView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        return self.change(request, request.data)
+
+    def put(self, request, product_id):
+        data = request.data
+        if isinstance(data, dict):
+            data = {'product_id': product_id, 'quantity': data.get('quantity', 1)}
+        # Anything else is rejected by the serializer, like a bad body to post
+        return self.change(request, data, replace=True)
+
+    def delete(self, request, product_id):
+        store, key = get_cart(request)
+        if key is not None:
+            store.remove(key, product_id)
+        return Response(cart_data(store.get(key) if key is not None else {}, {'request': request}))
+
+    def change(self, request, data, replace=False):
+        serializer = CartLineSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        product = Product.objects.only('pk', 'price').filter(pk=serializer.validated_data['product_id']).first()
+        if product is None:
+            raise exceptions.ItemDoesntExist(f'Product with a product id of {serializer.validated_data["product_id"]} does not exist')
+
+        store, key = get_cart(request)
+        new_key = key is None
+        if new_key:
+            key = new_cart_key()
+        if replace:
+            store.set(key, product, serializer.validated_data['quantity'])
+        else:
+            store.add(key, product, serializer.validated_data['quantity'])
+
+        response = Response(cart_data(store.get(key), {'request': request}))
+        if new_key:
+            response.set_cookie(settings.CART_COOKIE_NAME, key, max_age=settings.CART_TIMEOUT, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+def checkout(request):
+    """
+    Places an order for everything in the requesting client's cart and empties it.
+    """
+    store, key = get_cart(request)
+    lines = store.get(key) if key is not None else {}
+    if not lines:
+        raise exceptions.EmptyCartException
+
+    data = request.data
+    if isinstance(data, dict):
+        data = {field: value for field, value in data.items() if field != 'items'}
+        data['items'] = [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in lines.items()]
+    # Anything else is rejected by the serializer, and the cart is kept
+
+    serializer = OrderSerializer(data=data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    with transaction.atomic():
+        serializer.save()
+        if key is not None:
+            store.clear(key)
+
+    response = Response(serializer.data, status=status.HTTP_201_CREATED)
+    if not request.user.is_authenticated:
+        response.delete_cookie(settings.CART_COOKIE_NAME)
+    return response
+
+
+ORDER_ITEMS = Prefetch('items', queryset=OrderItem.objects.select_related('product__images'))
+
+
+class ExportNegotiation(BaseContentNegotiation):
+    """
+    Exports pick their format from ?format=, so errors are always rendered as JSON.
+    """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
 class OrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
-    queryset = Order.objects.all()
+    queryset = Order.objects.prefetch_related(ORDER_ITEMS)
+    pagination_class = OrderPagination
     permission_classes = [IsAdminOrWriteOnly]
 
+    @action(detail=False, content_negotiation_class=ExportNegotiation)
+    def export(self, request):
+        """
+        Streams every order placed between ?start= and ?end= as CSV, one line per item,
+        or as NDJSON, one order per line. A date as end includes that day.
+        """
+        export_format = request.query_params.get('format', 'csv')
+        if export_format not in FORMATS:
+            return Response({'error': f'\'format\' must be one of {", ".join(FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start = request.query_params.get('start')
+            start = parse_bound(start) if start else None
+            end = request.query_params.get('end')
+            end = parse_bound(end, end=True) if end else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(export_orders(export_format, start, end),
+                                         content_type=FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
 
 class AuthOrderViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     queryset = Order.objects.all()
+    pagination_class = OrderPagination
     permission_classes = [UserPermission]
 
     def get_queryset(self):
-        user = User.objects.get(pk=self.kwargs['user_pk'])
-        return Order.objects.filter(user=user)
+        return Order.objects.filter(user_id=self.kwargs['user_pk']).prefetch_related(ORDER_ITEMS)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -103,30 +324,63 @@ class AuthOrderViewSet(viewsets.ModelViewSet):
 
 
 class SearchView(generics.ListAPIView):
-    serializer_class = ProductSerializer
-
-    def get_queryset(self):
-        query_param = self.request.GET.get('q', '')
-        category_param = self.request.GET.get('category', '')
-
-        query = urllib.parse.unquote_plus(query_param)
-        category = urllib.parse.unquote_plus(category_param)
-
-        try:
-            category = int(category)
-        except:
-            pass
+    """
+    Products matching `q`, best first or in the order of `sort`, filtered by `category`,
+    `min_price`, `max_price` and `on_sale`. With `facets=true` the response also counts
+    the matches per category, flag and price range. `fields` and `expand` pick the
+    fields of the products, see fieldsets.product_fieldset.
+    """
+    serializer_class = ProductReadSerializer
+    pagination_class = SearchPagination
+
+    def get_search(self):
+        """
+        Returns the products matching the query and the {facet: condition} filters
+        the request applies to them.
+        """
+        query = urllib.parse.unquote_plus(self.request.GET.get('q', ''))
 
         queryset = None
         if query == '':
             queryset = Product.objects.all()
         else:
-            vector = SearchVector('name', weight='A') + SearchVector('description', weight='B')
-            queryset = Product.objects.annotate(rank=(SearchRank(vector, SearchQuery(query)))).filter(rank__gte=0.2).order_by('-rank')
+            queryset = get_search_backend().search(Product.objects.all(), query)
+
+        return queryset, product_filters(self.request)
 
-        valid_categories = map(lambda x: x[0], Product.CATEGORIES)
+    def get_queryset(self):
+        self.matches, self.filters = self.get_search()
+        queryset = self.matches.filter(*self.filters.values())
 
-        return queryset.filter(category=category) if category in valid_categories else queryset
+        # The pagination's cursor needs the ordering's values
+        ordering = ('pk',) + (product_sort(self.request) or ())
+        if 'rank' in queryset.query.annotations:
+            ordering += ('rank',)
+        return queryset.values(*product_values(product_fieldset(self.request), *ordering))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = product_fieldset(self.request)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if wants_facets(request):
+            response.data['facets'] = facet_counts(self.matches, self.filters)
+        return response
+
+
+@api_view(['GET'])
+def search_suggest(request):
+    """
+    Products to autocomplete a search with, by word prefix and typo-tolerant similarity.
+    """
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), MAX_LIMIT)
+    except ValueError:
+        return Response({'error': '\'limit\' is not an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(suggest(request.query_params.get('q', ''), limit))
 
 
 @api_view(['GET'])
@@ -143,16 +397,77 @@ def recommendations(request):
     except:
         return Response({'error': '\'id\' is not an integer'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if not Product.objects.all().filter(pk=pk):
-        return Response({'error': 'Can\'t generate recommendations from a product that does not exist'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    obj = Product.objects.get(pk=pk)
+    fieldset = product_fieldset(request)
+    queryset = list(only_fieldset(Product.objects.filter(recommended_for__product_id=pk), fieldset)
+                        .order_by('recommended_for__rank'))
 
-    queryset = Product.objects.all().filter(category=obj.category).exclude(pk=pk).order_by('?')[:4]
+    if not queryset:
+        # Products added since the last refresh have no stored recommendations yet
+        obj = Product.objects.only('category').filter(pk=pk).first()
+        if obj is None:
+            return Response({'error': 'Can\'t generate recommendations from a product that does not exist'}, status=status.HTTP_400_BAD_REQUEST)
 
-    serializer = ProductSerializer(queryset, many=True, context={'request': request})
+        queryset = only_fieldset(Product.objects.filter(category=obj.category), fieldset).exclude(pk=pk)[:TOP_N]
+
+    serializer = ProductSerializer(queryset, many=True, context={'request': request, 'fieldset': fieldset})
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+
+def media(request, path):
+    """
+    Serves a file from MEDIA_ROOT, or with MEDIA_SERVE set, tells the web server in
+    front of Django to send it so app workers never stream file contents.
+
+    Files with a content hash in their name never change and are cached forever. Uploaded
+    image sources, which keep their metadata, are never served.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith(ImageSet._meta.get_field('source').upload_to):
+        raise Http404('File does not exist')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid path')
+    if not os.path.isfile(fullpath):
+        raise Http404('File does not exist')
+
+    serve = getattr(settings, 'MEDIA_SERVE', None)
+    if serve == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = urllib.parse.quote(settings.MEDIA_ACCEL_PREFIX + path)
+    elif serve == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = fullpath
+    else:
+        response = FileResponse(open(fullpath, 'rb'))
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    response['Content-Type'] = content_type or 'application/octet-stream'
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    if is_hashed_name(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
  
 class CustomTokenObtainPairView(TokenObtainPairView):
-    serializer_class = CustomTokenObtainPairSerializer
\ No newline at end of file
+    serializer_class = CustomTokenObtainPairSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        response = Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+        # Logging in keeps what was put in the cart before
+        key = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if key:
+            persist_cart(key, serializer.user)
+            response.delete_cookie(settings.CART_COOKIE_NAME)
+        return response
\ No newline at end of file